@@ -10,54 +10,122 @@ AI-powered visual search engine for finding similar fashion products
 using CLIP embeddings and FAISS similarity search.
 """
 import os
+
+# Gunicorn threads already serve requests concurrently; keep the BLAS and
+# OpenMP pools single-threaded so they don't oversubscribe the CPUs.
+# Must run before torch/numpy are imported. An operator-supplied
+# OMP_NUM_THREADS is left for OpenMP itself to interpret.
+_PIN_TORCH_THREADS = "OMP_NUM_THREADS" not in os.environ
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+
 import sys
+import queue
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-import yaml
 from flask import Flask
 from flask_cors import CORS
-from threading import Thread
-import time
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
 import atexit
+import torch
 
 # Add project root to path
 sys.path.insert(0, str(Path(__file__).parent))
 
+from src.config import load_config
 from src.models import Database
 from src.services.image_service import ImageService
-from src.services.embedding_service import EmbeddingService
-from src.services.search_service import SearchService
+from src.services.registry import ServiceRegistry
 from src.routes.api import init_api
 from src.routes.ui import init_ui
 from src.middleware import init_rate_limiter, init_security_middleware
+from src.json_provider import init_json_provider
+
+if _PIN_TORCH_THREADS:
+    torch.set_num_threads(1)
+
+
+# Log records are handed to a background listener that owns the file and
+# console handlers; the queue is bounded so a stalled disk drops records
+# instead of blocking requests
+LOG_QUEUE_SIZE = 10000
+log_listener = None
+log_queue_handler = None
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that discards records when the queue is full."""
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def start_log_listener(handlers) -> None:
+    """Start a listener thread writing queued records to the given handlers."""
+    global log_listener
+    
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    log_queue_handler.queue = log_queue
+    log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+
 
+def stop_log_listener() -> None:
+    """Flush queued records and stop the listener thread."""
+    if log_listener is not None:
+        log_listener.stop()
 
-def load_config(config_path: str = "config.yaml") -> dict:
-    """Load configuration from YAML file."""
-    with open(config_path, 'r') as f:
-        config = yaml.safe_load(f)
-    return config
+
+def restart_log_listener_after_fork() -> None:
+    """Threads don't survive fork(); give preloaded workers their own listener."""
+    if log_listener is not None:
+        start_log_listener(log_listener.handlers)
+
+
+os.register_at_fork(after_in_child=restart_log_listener_after_fork)
 
 
 def setup_logging(config: dict) -> None:
     """Setup application logging."""
+    global log_queue_handler
+    
+    if log_queue_handler is not None:
+        return  # Already configured by an earlier create_app()
+    
     log_config = config['logging']
     log_dir = Path(log_config['log_file']).parent
     log_dir.mkdir(parents=True, exist_ok=True)
     
+    # Formatting happens on the listener thread; the queue handler only
+    # merges the message arguments
+    formatter = logging.Formatter(log_config['format'])
+    handlers = [
+        logging.FileHandler(log_config['log_file']),
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    log_queue_handler.setFormatter(logging.Formatter())
+    start_log_listener(handlers)
+    atexit.register(stop_log_listener)
+    
     logging.basicConfig(
         level=getattr(logging, log_config['level']),
-        format=log_config['format'],
-        handlers=[
-            logging.FileHandler(log_config['log_file']),
-            logging.StreamHandler()
-        ]
+        handlers=[log_queue_handler]
     )
 
 
 # Global variables for cleanup scheduler
 cleanup_thread = None
-cleanup_running = False
+cleanup_stop_event = Event()
 
 
 def cleanup_scheduler(image_service: ImageService, interval_minutes: int = 30, max_age_minutes: int = 60):
@@ -69,19 +137,13 @@ def cleanup_scheduler(image_service: ImageService, interval_minutes: int = 30, m
         interval_minutes: How often to run cleanup (default: 30 minutes)
         max_age_minutes: Age threshold for file deletion (default: 60 minutes)
     """
-    global cleanup_running
     logger = logging.getLogger(__name__)
     
     logger.info(f"Upload cleanup scheduler started (interval: {interval_minutes}min, max_age: {max_age_minutes}min)")
     
-    while cleanup_running:
+    # Wait for the interval; returns True immediately once a stop is requested
+    while not cleanup_stop_event.wait(interval_minutes * 60):
         try:
-            # Wait for the interval
-            time.sleep(interval_minutes * 60)
-            
-            if not cleanup_running:
-                break
-            
             # Perform cleanup
             deleted_count = image_service.cleanup_old_uploads(max_age_minutes)
             
@@ -98,7 +160,7 @@ def cleanup_scheduler(image_service: ImageService, interval_minutes: int = 30, m
 
 def start_cleanup_scheduler(image_service: ImageService, config: dict):
     """Start the background cleanup scheduler."""
-    global cleanup_thread, cleanup_running
+    global cleanup_thread
     
     cleanup_config = config.get('upload', {}).get('cleanup', {})
     enabled = cleanup_config.get('enabled', True)
@@ -110,7 +172,7 @@ def start_cleanup_scheduler(image_service: ImageService, config: dict):
     interval = cleanup_config.get('interval_minutes', 30)
     max_age = cleanup_config.get('max_age_minutes', 60)
     
-    cleanup_running = True
+    cleanup_stop_event.clear()
     cleanup_thread = Thread(
         target=cleanup_scheduler,
         args=(image_service, interval, max_age),
@@ -121,13 +183,10 @@ def start_cleanup_scheduler(image_service: ImageService, config: dict):
 
 def stop_cleanup_scheduler():
     """Stop the background cleanup scheduler."""
-    global cleanup_running, cleanup_thread
-    
-    if cleanup_thread and cleanup_running:
+    if cleanup_thread and cleanup_thread.is_alive():
         logging.getLogger(__name__).info("Stopping cleanup scheduler...")
-        cleanup_running = False
-        if cleanup_thread.is_alive():
-            cleanup_thread.join(timeout=5)
+        cleanup_stop_event.set()
+        cleanup_thread.join()
 
 
 def create_app(config_path: str = "config.yaml") -> Flask:
@@ -149,8 +208,10 @@ def create_app(config_path: str = "config.yaml") -> Flask:
     
     # Create Flask app
     app = Flask(__name__)
+    app.config['APP_CONFIG'] = config
     app.config['SECRET_KEY'] = config['app']['secret_key']
     app.config['MAX_CONTENT_LENGTH'] = config['upload']['max_file_size_mb'] * 1024 * 1024
+    init_json_provider(app)
     
     # Enable CORS - Allow all origins since we're serving both frontend and API
     CORS(app, resources={
@@ -181,29 +242,26 @@ def create_app(config_path: str = "config.yaml") -> Flask:
         # Initialize services
         logger.info("Initializing services...")
         image_service = ImageService(config)
-        embedding_service = EmbeddingService(config)
-        search_service = SearchService(config)
+        ml_services = ServiceRegistry(config)
         
-        # Load or build search index
-        if config['index']['rebuild_on_startup']:
-            logger.warning("Index rebuild on startup is enabled but not implemented here")
-            logger.warning("Run init_data.py to build the index")
+        # Loading CLIP and the index up front lets preloaded gunicorn workers
+        # share them; otherwise they are loaded on the first search request.
+        # GPU models are never loaded before the fork (see can_preload)
+        preload = config.get('performance', {}).get('preload_embeddings_on_startup', True)
+        if preload and ml_services.can_preload():
+            ml_services.get()
         else:
-            if search_service.index_exists():
-                logger.info("Loading existing search index...")
-                if search_service.load_index():
-                    logger.info("Search index loaded successfully")
-                    index_stats = search_service.get_index_stats()
-                    logger.info(f"Index contains {index_stats['num_products']} products")
-                else:
-                    logger.error("Failed to load search index")
-                    logger.warning("Run init_data.py to build the index")
-            else:
-                logger.warning("Search index not found")
-                logger.warning("Run init_data.py to build the index")
+            logger.info("ML services will be loaded on first search request")
+        
+        # Blocking I/O (URL downloads) runs here so a request can fetch the
+        # ML services while its download is in flight
+        io_workers = config.get('performance', {}).get('io_workers', 4)
+        io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='io')
+        app.extensions['io_executor'] = io_executor
+        atexit.register(io_executor.shutdown, wait=False)
         
         # Register blueprints
-        api_blueprint = init_api(db, image_service, embedding_service, search_service, config)
+        api_blueprint = init_api(db, image_service, ml_services, config)
         ui_blueprint = init_ui(config)
         
         app.register_blueprint(api_blueprint)
@@ -211,11 +269,6 @@ def create_app(config_path: str = "config.yaml") -> Flask:
         
         logger.info("Application initialized successfully")
         
-        # Log device info
-        device_info = embedding_service.get_device_info()
-        logger.info(f"Using device: {device_info['device']}")
-        logger.info(f"Model: {device_info['model']}")
-        
         # Start cleanup scheduler for uploaded files
         start_cleanup_scheduler(image_service, config)
         
@@ -251,8 +304,8 @@ if __name__ == "__main__":
     app = create_app()
     register_error_handlers(app)
     
-    # Load config for server settings
-    config = load_config()
+    # Reuse the config already loaded by create_app for server settings
+    config = app.config['APP_CONFIG']
     
     # Run app
     app.run(
@@ -1,3 +1,4 @@
+import os
 import multiprocessing
 
 # Server socket
@@ -5,9 +6,23 @@ bind = "0.0.0.0:5000"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+# Each worker holds its own CLIP model and runs inference on one core
+# (OMP_NUM_THREADS=1), so one worker per core; threads keep serving other
+# requests during a forward pass and feed the embedding micro-batcher
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Let the app know it is serving several workers (see ServiceRegistry)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_class = "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
 worker_connections = 1000
+
+# Application preloading
+# The master loads CLIP and the index once before forking: the FAISS index
+# and embeddings are memory-mapped, so every worker shares one copy through
+# the page cache, and CPU model weights are moved to shared memory. With
+# ml.device "cuda" on a GPU host the app skips loading CLIP in the master
+# (CUDA does not survive fork) and each worker loads its own model
+preload_app = True
 timeout = 120
 keepalive = 5
 
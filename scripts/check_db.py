@@ -0,0 +1,135 @@
+"""
+Report database health: GCS migration progress and duplicate products.
+
+Replaces the separate check_migration.py, check_old_urls.py and
+check_db_duplicates.py scripts. All counts are computed in a single
+pass over the products table.
+"""
+import sqlite3
+import argparse
+
+GCS_HOST = 'storage.googleapis.com'
+
+STATS_QUERY = '''
+    WITH stats AS (
+        SELECT image_path, cloudinary_url, instr(cloudinary_url, ?) > 0 AS is_gcs
+        FROM products
+    )
+    SELECT
+        COUNT(*),
+        COUNT(DISTINCT image_path),
+        COUNT(cloudinary_url),
+        COUNT(DISTINCT cloudinary_url),
+        COALESCE(SUM(is_gcs), 0),
+        COALESCE(SUM(NOT is_gcs), 0)
+    FROM stats
+'''
+
+
+def get_stats(cursor) -> dict:
+    """
+    Compute all product counts in one table scan.
+
+    Args:
+        cursor: SQLite cursor
+
+    Returns:
+        Dictionary of counts
+    """
+    cursor.execute(STATS_QUERY, (GCS_HOST,))
+    total, unique_paths, with_url, unique_urls, gcs, old = cursor.fetchone()
+    return {
+        'total': total,
+        'unique_paths': unique_paths,
+        'with_url': with_url,
+        'unique_urls': unique_urls,
+        'gcs': gcs,
+        'old': old
+    }
+
+
+def print_samples(cursor, limit: int) -> None:
+    """Print sample GCS and old (not migrated) URLs."""
+    cursor.execute(
+        "SELECT cloudinary_url FROM products WHERE instr(cloudinary_url, ?) > 0 LIMIT ?",
+        (GCS_HOST, limit)
+    )
+    print(f'\n🔗 Sample GCS URLs:')
+    for row in cursor.fetchall():
+        print(f'  {row[0]}')
+
+    cursor.execute(
+        "SELECT cloudinary_url FROM products WHERE instr(cloudinary_url, ?) = 0 LIMIT ?",
+        (GCS_HOST, limit)
+    )
+    print(f'\n📋 Sample old URLs:')
+    for row in cursor.fetchall():
+        print(f'  {row[0]}')
+
+
+def print_duplicates(cursor, stats: dict, limit: int) -> None:
+    """Print duplicate image paths and shared Cloudinary URLs, if any."""
+    print('\nSample duplicate image paths:')
+    if stats['unique_paths'] < stats['total']:
+        cursor.execute('''
+            SELECT image_path, COUNT(*) as cnt
+            FROM products
+            GROUP BY image_path
+            HAVING cnt > 1
+            LIMIT ?
+        ''', (limit,))
+        for path, count in cursor.fetchall():
+            print(f'  {path}: {count} times')
+    else:
+        print('  No duplicates found!')
+
+    print(f'\nChecking for potential duplicate updates...')
+    if stats['unique_urls'] < stats['with_url']:
+        cursor.execute('''
+            SELECT cloudinary_url, COUNT(*) as cnt
+            FROM products
+            WHERE cloudinary_url IS NOT NULL
+            GROUP BY cloudinary_url
+            HAVING cnt > 1
+            LIMIT ?
+        ''', (limit,))
+        cloud_dupes = cursor.fetchall()
+
+        print('Found products sharing same Cloudinary URL:')
+        for url, count in cloud_dupes:
+            print(f'  {url}: {count} products')
+            cursor.execute('SELECT id, image_path FROM products WHERE cloudinary_url = ? LIMIT 3', (url,))
+            for pid, path in cursor.fetchall():
+                print(f'    - Product {pid}: {path}')
+    else:
+        print('No duplicate Cloudinary URLs found')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db', default='data/products.db', help='Path to SQLite database')
+    parser.add_argument('--samples', type=int, default=5, help='Number of sample rows to show')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        cursor = conn.cursor()
+        stats = get_stats(cursor)
+
+        print(f'📊 Total products: {stats["total"]}')
+        print(f'✅ Products with GCS URLs: {stats["gcs"]}')
+        print(f'🔴 Products with OLD URLs (not migrated): {stats["old"]}')
+        print(f'\nDatabase Statistics:')
+        print(f'  Unique image paths: {stats["unique_paths"]}')
+        print(f'  Products with cloudinary_url: {stats["with_url"]}')
+        print(f'  Unique cloudinary URLs: {stats["unique_urls"]}')
+
+        if args.samples > 0:
+            print_samples(cursor, args.samples)
+            print_duplicates(cursor, stats, args.samples)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Shared SQL helpers for the Cloudinary, GCS and database scripts.
+"""
+
+# SQL expression for the filename part of products.image_path (after the
+# last slash or backslash): rtrim() strips the trailing non-separator
+# characters, leaving the directory prefix to remove. Same expression as
+# the image_basename column that src.models adds to newer databases
+_SQL_PATH = "replace(image_path, '\\', '/')"
+SQL_BASENAME = f"replace({_SQL_PATH}, rtrim({_SQL_PATH}, replace({_SQL_PATH}, '/', '')), '')"
+
+
+def tune_connection(conn) -> None:
+    """
+    Tune a script's SQLite connection for bulk updates of the products table.
+    
+    WAL lets the app keep reading while the script writes, and NORMAL sync
+    is safe with WAL (commits skip the fsync of the main database file);
+    temp tables and the B-trees behind IN lists stay in memory.
+    
+    Args:
+        conn: sqlite3 connection (or cursor) to the products database
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def basename_sql(columns) -> str:
+    """
+    SQL for a product's image filename, using the indexed column if present.
+    
+    Args:
+        columns: Column names of the products table (from PRAGMA table_xinfo,
+            which lists generated columns)
+        
+    Returns:
+        "image_basename" when the table has it, else SQL_BASENAME
+    """
+    return 'image_basename' if 'image_basename' in columns else SQL_BASENAME
@@ -2,8 +2,8 @@
 Fix database entries that were incorrectly updated due to substring matching.
 This script will reset cloudinary_url for products that have the wrong URL.
 """
+import os
 import sqlite3
-from pathlib import Path
 
 def fix_database():
     conn = sqlite3.connect('data/products.db')
@@ -17,49 +17,54 @@ def fix_database():
         FROM products 
         WHERE cloudinary_url IS NOT NULL
     ''')
-    products = cursor.fetchall()
     
-    incorrect_count = 0
-    fixed_count = 0
+    analyzed_count = 0
+    updates = []
     
-    for product_id, image_path, cloudinary_url, local_path in products:
+    for product_id, image_path, cloudinary_url, local_path in cursor:
+        analyzed_count += 1
+        
         # Extract the filename from image_path
+        # e.g., "11163" from "11163.jpg"; string ops avoid a Path per row
         if image_path:
-            local_filename = Path(image_path).stem  # e.g., "11163" from "11163.jpg"
+            local_filename = os.path.splitext(os.path.basename(image_path))[0]
         elif local_path:
-            local_filename = Path(local_path).stem
+            local_filename = os.path.splitext(os.path.basename(local_path))[0]
         else:
             continue
         
         # Extract the filename from cloudinary_url
         # URL format: https://res.cloudinary.com/.../visual-product-matcher/1163.jpg
         if cloudinary_url:
-            cloud_filename = cloudinary_url.split('/')[-1].replace('.jpg', '')  # e.g., "1163"
+            cloud_filename = cloudinary_url.rpartition('/')[2].replace('.jpg', '')  # e.g., "1163"
         else:
             continue
         
         # Check if they match
         if local_filename != cloud_filename:
             # This product has the wrong Cloudinary URL!
-            incorrect_count += 1
             print(f"Product {product_id}: {image_path} has wrong URL: {cloudinary_url}")
             
             # Option: Reset to None so it can be re-uploaded correctly
             # Or restore from local_image_path
-            cursor.execute('''
-                UPDATE products 
-                SET cloudinary_url = NULL,
-                    image_path = ?
-                WHERE id = ?
-            ''', (local_path or image_path, product_id))
-            fixed_count += 1
+            updates.append((local_path or image_path, product_id))
+    
+    # Apply all fixes in one batch once the scan is complete
+    incorrect_count = len(updates)
+    cursor.executemany('''
+        UPDATE products 
+        SET cloudinary_url = NULL,
+            image_path = ?
+        WHERE id = ?
+    ''', updates)
+    fixed_count = len(updates)
     
     conn.commit()
     
     print(f"\n{'='*60}")
     print(f"Fix Summary:")
     print(f"{'='*60}")
-    print(f"Products analyzed: {len(products)}")
+    print(f"Products analyzed: {analyzed_count}")
     print(f"Incorrect assignments found: {incorrect_count}")
     print(f"Products fixed: {fixed_count}")
     
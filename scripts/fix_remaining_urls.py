@@ -7,12 +7,15 @@ import sys
 import sqlite3
 import logging
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
+from google.api_core.exceptions import PreconditionFailed
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from threading import Lock
 from dotenv import load_dotenv
 
+from cloudinary_utils import tune_connection
+from gcs_utils import UPLOAD_RETRY, size_connection_pool
+
 # Load environment variables
 load_dotenv()
 
@@ -27,83 +30,112 @@ logger = logging.getLogger(__name__)
 DB_PATH = "data/products.db"
 IMAGE_DIR = "fashion-images/fashion-images"
 GCS_BUCKET_NAME = "visual-product-matcher-images"
+GCS_PREFIX = "products/"
+
+# Upload concurrency (connections share the client's HTTP session)
+MAX_WORKERS = 20
+UPLOAD_CHUNK_SIZE = 500
 
-# Thread-safe stats and locks
 stats = {'uploaded': 0, 'errors': 0}
-stats_lock = Lock()
-db_lock = Lock()
 
 
-def get_products_with_old_urls():
-    """Get all products that still have old Cloudinary URLs."""
+def iter_products_with_old_urls():
+    """Yield (id, image_path) for products that still have old Cloudinary URLs."""
     conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    try:
+        cursor = conn.execute("""
+            SELECT id, image_path 
+            FROM products 
+            WHERE instr(cloudinary_url, 'storage.googleapis.com') = 0
+        """)
+        yield from cursor
+    finally:
+        conn.close()
+
+
+def group_products_by_filename(products):
+    """
+    Group product IDs by image filename; each file is uploaded once.
+    
+    Products whose image file is missing are counted as errors.
+    
+    Returns:
+        Tuple of (dict of filename -> product IDs, total products seen)
+    """
+    products_by_filename = {}
+    total = 0
     
-    cursor.execute("""
-        SELECT id, image_path, cloudinary_url 
-        FROM products 
-        WHERE cloudinary_url NOT LIKE '%storage.googleapis.com%'
-    """)
+    for product_id, image_path in products:
+        total += 1
+        filename = os.path.basename(image_path)
+        if not os.path.exists(os.path.join(IMAGE_DIR, filename)):
+            logger.warning(f"File not found: {os.path.join(IMAGE_DIR, filename)}")
+            stats['errors'] += 1
+            continue
+        products_by_filename.setdefault(filename, []).append(product_id)
     
-    products = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return products
+    return products_by_filename, total
 
 
-def upload_and_update(bucket, product):
-    """Upload image and update database for a single product."""
-    try:
-        product_id = product['id']
-        image_path = product['image_path']
-        
-        # Get filename from image_path
-        filename = os.path.basename(image_path)
-        local_path = os.path.join(IMAGE_DIR, filename)
-        
-        # Check if file exists
-        if not os.path.exists(local_path):
-            logger.warning(f"File not found: {local_path}")
-            with stats_lock:
-                stats['errors'] += 1
-            return
-        
-        # Upload to GCS
-        gcs_path = f"products/{filename}"
-        blob = bucket.blob(gcs_path)
-        
-        # Check if already exists in GCS
-        if blob.exists():
-            # Already uploaded, just update database
-            gcs_url = f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{gcs_path}"
-        else:
-            # Upload the file
-            blob.upload_from_filename(
-                local_path,
-                content_type='image/jpeg',
-                timeout=300
-            )
-            # Bucket is already public, no need to make_public()
-            gcs_url = f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{gcs_path}"
+def upload_products(bucket, products_by_filename, total):
+    """
+    Upload images for products with GCS's transfer manager.
+    
+    Blobs that already exist are skipped server-side (if_generation_match=0)
+    and still count as uploaded, so only their database row is updated.
+    
+    Args:
+        bucket: GCS bucket to upload into
+        products_by_filename: Dict of filename -> product IDs
+        total: Total number of products, including missing files
+    
+    Returns:
+        List of (gcs_url, product_id) tuples for the database update
+    """
+    filenames = list(products_by_filename)
+    updates = []
+    
+    with tqdm(total=total, desc="Fixing", unit="product") as pbar:
+        pbar.update(stats['errors'])  # Missing files
         
-        # Update database
-        with db_lock:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE products SET cloudinary_url = ? WHERE id = ?",
-                (gcs_url, product_id)
+        for start in range(0, len(filenames), UPLOAD_CHUNK_SIZE):
+            chunk = filenames[start:start + UPLOAD_CHUNK_SIZE]
+            results = transfer_manager.upload_many_from_filenames(
+                bucket,
+                chunk,
+                source_directory=IMAGE_DIR,
+                blob_name_prefix=GCS_PREFIX,
+                skip_if_exists=True,
+                upload_kwargs={'content_type': 'image/jpeg', 'timeout': 300, 'retry': UPLOAD_RETRY},
+                worker_type=transfer_manager.THREAD,
+                max_workers=MAX_WORKERS
             )
-            conn.commit()
-            conn.close()
-        
-        with stats_lock:
-            stats['uploaded'] += 1
-        
-    except Exception as e:
-        logger.error(f"Error processing product {product.get('id')}: {str(e)}")
-        with stats_lock:
-            stats['errors'] += 1
+            
+            for filename, result in zip(chunk, results):
+                product_ids = products_by_filename[filename]
+                
+                # None means uploaded; PreconditionFailed means it already existed
+                if result is None or isinstance(result, PreconditionFailed):
+                    gcs_url = f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{GCS_PREFIX}{filename}"
+                    updates.extend((gcs_url, product_id) for product_id in product_ids)
+                    stats['uploaded'] += len(product_ids)
+                else:
+                    logger.error(f"Error uploading {filename}: {str(result)}")
+                    stats['errors'] += len(product_ids)
+                
+                pbar.update(len(product_ids))
+    
+    return updates
+
+
+def update_database(conn, updates):
+    """Write all collected (gcs_url, product_id) pairs in a single transaction."""
+    cursor = conn.cursor()
+    cursor.executemany(
+        "UPDATE products SET cloudinary_url = ? WHERE id = ?",
+        updates
+    )
+    conn.commit()
 
 
 def main():
@@ -113,10 +145,10 @@ def main():
     
     # Get products with old URLs
     logger.info("Finding products with old Cloudinary URLs...")
-    products = get_products_with_old_urls()
-    logger.info(f"Found {len(products)} products to fix")
+    products_by_filename, total = group_products_by_filename(iter_products_with_old_urls())
+    logger.info(f"Found {total} products to fix")
     
-    if not products:
+    if not total:
         logger.info("✅ All products already have GCS URLs!")
         return
     
@@ -130,26 +162,27 @@ def main():
         os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = creds_path
     
     storage_client = storage.Client()
+    size_connection_pool(storage_client, MAX_WORKERS)
     bucket = storage_client.bucket(GCS_BUCKET_NAME)
     
-    # Process products with progress bar
-    logger.info(f"Processing {len(products)} products with 20 workers...")
+    # Upload images; all database writes happen afterwards in one transaction
+    logger.info(f"Processing {total} products with {MAX_WORKERS} workers...")
+    updates = upload_products(bucket, products_by_filename, total)
     
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        futures = [
-            executor.submit(upload_and_update, bucket, product)
-            for product in products
-        ]
-        
-        # Show progress
-        for _ in tqdm(as_completed(futures), total=len(products), desc="Fixing", unit="product"):
-            pass
+    # Update database
+    logger.info(f"Writing {len(updates)} URL updates to database...")
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        tune_connection(conn)
+        update_database(conn, updates)
+    finally:
+        conn.close()
     
     # Summary
     logger.info("="*80)
     logger.info("SUMMARY")
     logger.info("="*80)
-    logger.info(f"Total products: {len(products)}")
+    logger.info(f"Total products: {total}")
     logger.info(f"Successfully updated: {stats['uploaded']}")
     logger.info(f"Errors: {stats['errors']}")
     logger.info("="*80)
@@ -0,0 +1,28 @@
+"""
+Shared Google Cloud Storage helpers for the migration scripts.
+"""
+from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
+from requests.adapters import HTTPAdapter
+
+GCS_ENDPOINT = 'https://storage.googleapis.com'
+
+# Retry transient 429/5xx errors with exponential backoff. Uploads without a
+# generation precondition are not retried by default on older clients
+UPLOAD_RETRY = DEFAULT_RETRY.with_deadline(120.0)
+
+
+def size_connection_pool(client: storage.Client, max_workers: int) -> None:
+    """
+    Give each upload thread its own pooled HTTPS connection to GCS.
+    
+    requests keeps only 10 connections per host by default; extra threads
+    would pay a fresh TLS handshake for every upload. Only the storage
+    endpoint is remounted so token refreshes keep the default adapter.
+    
+    Args:
+        client: Storage client whose HTTP session is resized
+        max_workers: Number of concurrent upload threads
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    client._http.mount(GCS_ENDPOINT, adapter)
@@ -2,16 +2,18 @@
 Data initialization script to scan fashion images, generate embeddings, and build FAISS index.
 """
 import os
+import re
 import sys
 import logging
 from pathlib import Path
 from typing import List, Tuple
-import yaml
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
+from src.config import load_config
 from src.models import Database, Product
 from src.services.embedding_service import EmbeddingService
 from src.services.search_service import SearchService
@@ -24,12 +26,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Worker processes and per-task chunk size used to read image headers
+METADATA_WORKERS = os.cpu_count()
+METADATA_CHUNK_SIZE = 128
 
-def load_config(config_path: str = "config.yaml") -> dict:
-    """Load configuration from YAML file."""
-    with open(config_path, 'r') as f:
-        config = yaml.safe_load(f)
-    return config
+# Word separators in image file and directory names
+SEPARATOR_PATTERN = re.compile(r'[_-]')
 
 
 def scan_images(images_directory: str, supported_formats: List[str]) -> List[str]:
@@ -45,26 +47,39 @@ def scan_images(images_directory: str, supported_formats: List[str]) -> List[str
     """
     logger.info(f"Scanning images in {images_directory}")
     
-    image_paths = set()  # Use set to avoid duplicates
-    images_path = Path(images_directory)
-    
-    if not images_path.exists():
+    if not os.path.isdir(images_directory):
         logger.error(f"Images directory not found: {images_directory}")
         return []
     
-    # Scan for images (case-insensitive to avoid duplicates on Windows)
-    for ext in supported_formats:
-        # Search for both lowercase and uppercase extensions
-        # but use a set to deduplicate (Windows filesystem is case-insensitive)
-        for pattern in [f"*.{ext}", f"*.{ext.upper()}"]:
-            image_paths.update(images_path.rglob(pattern))
+    # Single directory walk with case-insensitive extension matching
+    extensions = {ext.lower() for ext in supported_formats}
+    image_paths = []
+    
+    for root, _, files in os.walk(images_directory):
+        for filename in files:
+            _, dot, ext = filename.rpartition('.')
+            if dot and ext.lower() in extensions:
+                image_paths.append(os.path.join(root, filename))
     
-    image_paths = sorted([str(p) for p in image_paths])  # Sort for consistency
+    image_paths.sort()  # Sort for consistency
     logger.info(f"Found {len(image_paths)} images")
     
     return image_paths
 
 
+def normalize_image_path(image_path: str) -> str:
+    """
+    Normalize an image path for storage in the database.
+    
+    Args:
+        image_path: Path to image file
+        
+    Returns:
+        Path with redundant "./" segments removed and forward slashes
+    """
+    return os.path.normpath(image_path).replace(os.sep, '/')
+
+
 def extract_product_name(image_path: str) -> str:
     """
     Extract product name from image filename.
@@ -75,9 +90,9 @@ def extract_product_name(image_path: str) -> str:
     Returns:
         Product name
     """
-    filename = Path(image_path).stem
+    filename = os.path.splitext(os.path.basename(image_path))[0]
     # Replace underscores and hyphens with spaces
-    name = filename.replace('_', ' ').replace('-', ' ')
+    name = SEPARATOR_PATTERN.sub(' ', filename)
     # Capitalize words
     name = ' '.join(word.capitalize() for word in name.split())
     return name
@@ -96,15 +111,15 @@ def extract_category(image_path: str, base_directory: str) -> str:
     """
     try:
         # Get relative path from base directory
-        rel_path = Path(image_path).relative_to(base_directory)
+        rel_path = os.path.relpath(image_path, base_directory).replace(os.sep, '/')
+        parts = rel_path.split('/', 1)
         
         # If image is in a subdirectory, use first directory as category
-        if len(rel_path.parts) > 1:
-            category = rel_path.parts[0]
-            return category.replace('_', ' ').replace('-', ' ').title()
+        if len(parts) > 1 and parts[0] != '..':
+            return SEPARATOR_PATTERN.sub(' ', parts[0]).title()
         
     except ValueError:
-        pass
+        pass  # Different drive than base directory (Windows)
     
     return 'Fashion'
 
@@ -129,27 +144,42 @@ def populate_database(
     """
     logger.info("Populating database with product metadata")
     
-    product_mappings = []
+    # Load all known paths once instead of querying per image
+    existing_ids = db.get_product_ids_by_path()
     
-    for image_path in tqdm(image_paths, desc="Processing products"):
+    processed = []  # (normalized_path, image_path) in input order
+    pending = {}  # normalized_path -> image_path for products not yet in database
+    
+    for image_path in image_paths:
+        normalized_path = normalize_image_path(image_path)
+        processed.append((normalized_path, image_path))
+        
+        # Skip if already exists
+        if normalized_path not in existing_ids:
+            pending.setdefault(normalized_path, image_path)
+    
+    # Read image headers in worker processes so header parsing is not GIL-bound
+    with ProcessPoolExecutor(max_workers=METADATA_WORKERS) as executor:
+        metadata_results = list(tqdm(
+            executor.map(
+                image_service.get_image_metadata,
+                pending.values(),
+                chunksize=METADATA_CHUNK_SIZE
+            ),
+            total=len(pending),
+            desc="Processing products"
+        ))
+    
+    new_products = []
+    
+    for (normalized_path, image_path), metadata in zip(pending.items(), metadata_results):
         try:
-            # Normalize path: convert to forward slashes
-            normalized_path = str(Path(image_path).as_posix())
-            
-            # Skip if already exists
-            if db.product_exists(normalized_path):
-                existing_product = db.get_product_by_path(normalized_path)
-                if existing_product:
-                    product_mappings.append((existing_product.id, image_path))
-                continue
-            
             # Extract metadata
             name = extract_product_name(image_path)
             category = extract_category(image_path, images_directory)
-            metadata = image_service.get_image_metadata(image_path)
             
             # Create product
-            product = Product(
+            new_products.append(Product(
                 id=0,  # Will be auto-assigned
                 name=name,
                 image_path=normalized_path,  # Store normalized path
@@ -158,15 +188,22 @@ def populate_database(
                 width=metadata.get('width'),
                 height=metadata.get('height'),
                 format=metadata.get('format')
-            )
-            
-            # Insert into database
-            product_id = db.insert_product(product)
-            product_mappings.append((product_id, image_path))
+            ))
             
         except Exception as e:
             logger.error(f"Error processing {image_path}: {str(e)}")
-            continue
+    
+    # Insert new products in batches, then resolve their assigned IDs
+    if new_products:
+        db.insert_products(new_products)
+        db.analyze()
+        existing_ids = db.get_product_ids_by_path()
+    
+    product_mappings = [
+        (existing_ids[normalized_path], image_path)
+        for normalized_path, image_path in processed
+        if normalized_path in existing_ids
+    ]
     
     logger.info(f"Database populated with {len(product_mappings)} products")
     return product_mappings
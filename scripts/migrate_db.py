@@ -6,6 +6,8 @@ import sqlite3
 import logging
 from pathlib import Path
 
+from cloudinary_utils import SQL_BASENAME
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -23,10 +25,18 @@ def migrate_database(db_path: str = "data/products.db"):
     
     try:
         with sqlite3.connect(db_path) as conn:
+            # WAL mode persists in the database file, so later scripts and
+            # the app's readers no longer block on writers
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
             cursor = conn.cursor()
             
-            # Check if columns already exist
-            cursor.execute("PRAGMA table_info(products)")
+            # Run all schema changes in one transaction (one commit instead
+            # of one per DDL statement in autocommit mode)
+            cursor.execute("BEGIN")
+            
+            # Check if columns already exist (table_xinfo also lists generated ones)
+            cursor.execute("PRAGMA table_xinfo(products)")
             columns = [row[1] for row in cursor.fetchall()]
             
             # Add cloudinary_url column if it doesn't exist
@@ -51,6 +61,29 @@ def migrate_database(db_path: str = "data/products.db"):
             else:
                 logger.info("local_image_path column already exists")
             
+            # Add gcs_url column used by migrate_to_gcs.py if it doesn't exist
+            if 'gcs_url' not in columns:
+                logger.info("Adding gcs_url column...")
+                cursor.execute("""
+                    ALTER TABLE products 
+                    ADD COLUMN gcs_url TEXT
+                """)
+                logger.info("✓ Added gcs_url column")
+            else:
+                logger.info("gcs_url column already exists")
+            
+            # Add the image_basename generated column the upload and sync
+            # scripts match filenames on; VIRTUAL, so it is never stored
+            if 'image_basename' not in columns:
+                logger.info("Adding image_basename column...")
+                cursor.execute(f"""
+                    ALTER TABLE products 
+                    ADD COLUMN image_basename TEXT GENERATED ALWAYS AS ({SQL_BASENAME}) VIRTUAL
+                """)
+                logger.info("✓ Added image_basename column")
+            else:
+                logger.info("image_basename column already exists")
+            
             # Create index on cloudinary_url for faster lookups
             try:
                 cursor.execute("""
@@ -58,13 +91,27 @@ def migrate_database(db_path: str = "data/products.db"):
                     ON products(cloudinary_url)
                 """)
                 logger.info("✓ Created index on cloudinary_url")
+                
+                # Expression index used by the GCS migration checks
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_cloudinary_url_is_gcs 
+                    ON products(instr(cloudinary_url, 'storage.googleapis.com'))
+                """)
+                logger.info("✓ Created GCS URL index on cloudinary_url")
+                
+                # Exact filename matches seek instead of scanning products
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_image_basename 
+                    ON products(image_basename)
+                """)
+                logger.info("✓ Created index on image_basename")
             except sqlite3.OperationalError:
                 pass  # Index might already exist
             
             conn.commit()
             
             # Show table structure
-            cursor.execute("PRAGMA table_info(products)")
+            cursor.execute("PRAGMA table_xinfo(products)")
             columns_info = cursor.fetchall()
             
             logger.info("\nCurrent table structure:")
@@ -4,18 +4,24 @@ This script uploads all images to GCS and updates the database with public URLs.
 """
 import os
 import sys
+import time
+import queue
 import sqlite3
 import json
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+from threading import Lock, Thread
 import logging
-from typing import Optional, Tuple
+from itertools import islice
+from typing import Iterator, Optional, Tuple
 from tqdm import tqdm
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
 from google.cloud.exceptions import GoogleCloudError
 from dotenv import load_dotenv
 
+from cloudinary_utils import tune_connection
+from gcs_utils import UPLOAD_RETRY, size_connection_pool
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -48,8 +54,29 @@ GCS_BUCKET_NAME = os.getenv('GCS_BUCKET_NAME', 'visual-product-matcher-images')
 GCS_PROJECT_ID = os.getenv('GCS_PROJECT_ID') or get_project_id_from_credentials()
 GCS_BASE_URL = f"https://storage.googleapis.com/{GCS_BUCKET_NAME}"
 
+# Uploads are handed to the transfer manager in chunks of this many files
+UPLOAD_CHUNK_SIZE = 500
+
+# Files above this size are uploaded as parallel XML multipart chunks
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+LARGE_FILE_WORKERS = 4
+
+IMAGE_EXTENSIONS = frozenset({'jpg', 'jpeg', 'png', 'webp'})
+
+CONTENT_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp'
+}
+
+# Database writes are batched by a single writer thread
+WRITE_BATCH_SIZE = 500
+WRITE_FLUSH_SECONDS = 1.0
+write_queue = queue.Queue()
+_WRITER_STOP = object()
+
 # Threading
-db_lock = Lock()
 stats_lock = Lock()
 stats = {
     'uploaded': 0,
@@ -122,210 +149,287 @@ def make_bucket_public(bucket: storage.Bucket) -> None:
         logger.error("You may need to do this manually in GCP Console")
 
 
-def get_all_images(images_dir: Path) -> list:
-    """Get all image files from directory."""
-    image_extensions = {'.jpg', '.jpeg', '.png', '.webp'}
-    images = []
-    
-    if not images_dir.exists():
-        logger.error(f"Images directory not found: {images_dir}")
-        return images
+def iter_images(images_dir: Path) -> Iterator[Tuple[Path, str]]:
+    """
+    Yield (full_path, rel_path) for image files as they are discovered.
     
-    logger.info(f"Scanning directory: {images_dir}")
+    Uses os.scandir directly so directory entries don't need extra stat calls.
+    """
+    stack = [str(images_dir)]
+    # Entry paths all start with images_dir plus a separator; slicing that
+    # prefix off is much cheaper than os.path.relpath per file
+    base_len = len(os.path.join(stack[0], ''))
+    
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    _, dot, ext = entry.name.rpartition('.')
+                    if dot and ext.lower() in IMAGE_EXTENSIONS:
+                        yield Path(entry.path), entry.path[base_len:]
+
+
+def _open_db() -> sqlite3.Connection:
+    """Open a database connection tuned for concurrent worker threads."""
+    conn = sqlite3.connect(DB_PATH)
+    tune_connection(conn)
+    # Worker threads share the database; busy_timeout retries on lock
+    conn.execute("PRAGMA busy_timeout=5000")
+    # Map the database file (256MB) and allow a 64MB page cache for reads
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    return conn
+
+
+def load_product_index() -> Tuple[dict, dict]:
+    """
+    Load all products once for in-memory lookups by image path.
     
-    for root, dirs, files in os.walk(images_dir):
-        for file in files:
-            ext = Path(file).suffix.lower()
-            if ext in image_extensions:
-                full_path = Path(root) / file
-                # Get relative path from images_dir
-                rel_path = full_path.relative_to(images_dir)
-                images.append((full_path, str(rel_path)))
+    Returns:
+        Tuple of (exact_index, suffix_index). exact_index maps image_path to
+        the product; suffix_index maps every trailing run of path components
+        (e.g. "a/b.jpg" and "b.jpg" for "x/a/b.jpg") to the first product
+        with that suffix.
+    """
+    exact_index = {}
+    suffix_index = {}
     
-    logger.info(f"Found {len(images)} images")
-    return images
+    conn = _open_db()
+    try:
+        conn.row_factory = sqlite3.Row
+        for row in conn.execute("SELECT id, image_path, cloudinary_url FROM products ORDER BY id"):
+            product = dict(row)
+            image_path = product['image_path'] or ''
+            exact_index.setdefault(image_path, product)
+            
+            parts = image_path.split('/')
+            for i in range(1, len(parts)):
+                suffix_index.setdefault('/'.join(parts[i:]), product)
+    finally:
+        conn.close()
+    
+    logger.info(f"Loaded {len(exact_index)} products from database")
+    return exact_index, suffix_index
+
+
+def find_product(rel_path: str, exact_index: dict, suffix_index: dict) -> Optional[dict]:
+    """Find a product by exact image path, falling back to a path-suffix match."""
+    rel_path = rel_path.replace(os.sep, '/')
+    return exact_index.get(rel_path) or suffix_index.get(rel_path)
 
 
-def get_product_by_image_path(image_path: str) -> Optional[dict]:
-    """Get product from database by image path."""
+def ensure_gcs_url_column() -> None:
+    """Add the gcs_url column to the products table if it doesn't exist."""
+    conn = _open_db()
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            # Try exact match first
-            cursor.execute(
-                "SELECT id, image_path, cloudinary_url FROM products WHERE image_path = ?",
-                (image_path,)
-            )
-            result = cursor.fetchone()
-            
-            if result:
-                return dict(result)
-            
-            # Try partial match (for nested paths)
-            cursor.execute(
-                "SELECT id, image_path, cloudinary_url FROM products WHERE image_path LIKE ?",
-                (f"%{image_path}%",)
+        conn.execute("ALTER TABLE products ADD COLUMN gcs_url TEXT")
+        conn.commit()
+        logger.info("Added gcs_url column to products table")
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    finally:
+        conn.close()
+
+
+def _flush_updates(conn: sqlite3.Connection, pending: list) -> None:
+    """Write a batch of (product_id, gcs_url) updates in one transaction."""
+    try:
+        with conn:
+            conn.executemany(
+                "UPDATE products SET cloudinary_url = ?, gcs_url = ? WHERE id = ?",
+                [(gcs_url, gcs_url, product_id) for product_id, gcs_url in pending]
             )
-            result = cursor.fetchone()
-            
-            return dict(result) if result else None
-            
     except sqlite3.Error as e:
-        logger.error(f"Database error: {e}")
-        return None
+        logger.error(f"Database error updating {len(pending)} products: {e}")
+        with stats_lock:
+            stats['uploaded'] -= len(pending)
+            stats['errors'] += len(pending)
 
 
-def update_product_gcs_url(product_id: int, gcs_url: str) -> bool:
-    """Update product with GCS URL in database."""
+def db_writer() -> None:
+    """
+    Drain write_queue and commit updates in batches.
+    
+    Flushes every WRITE_BATCH_SIZE rows or WRITE_FLUSH_SECONDS, whichever
+    comes first, and once more when the stop sentinel is received.
+    """
+    conn = _open_db()
+    pending = []
+    last_flush = time.monotonic()
+    
     try:
-        with db_lock:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                
-                # Add gcs_url column if it doesn't exist
-                try:
-                    cursor.execute("""
-                        ALTER TABLE products ADD COLUMN gcs_url TEXT
-                    """)
-                    logger.info("Added gcs_url column to products table")
-                except sqlite3.OperationalError:
-                    pass  # Column already exists
-                
-                # Update the product
-                cursor.execute("""
-                    UPDATE products 
-                    SET cloudinary_url = ?, gcs_url = ?
-                    WHERE id = ?
-                """, (gcs_url, gcs_url, product_id))
-                
-                conn.commit()
-                return True
-                
-    except sqlite3.Error as e:
-        logger.error(f"Database error updating product {product_id}: {e}")
-        return False
+        while True:
+            try:
+                item = write_queue.get(timeout=0.5)
+            except queue.Empty:
+                item = None
+            
+            if item is _WRITER_STOP:
+                break
+            if item is not None:
+                pending.append(item)
+            
+            if pending and (
+                len(pending) >= WRITE_BATCH_SIZE
+                or time.monotonic() - last_flush >= WRITE_FLUSH_SECONDS
+            ):
+                _flush_updates(conn, pending)
+                pending = []
+                last_flush = time.monotonic()
+        
+        if pending:
+            _flush_updates(conn, pending)
+    finally:
+        conn.close()
 
 
-def upload_image_to_gcs(
-    bucket: storage.Bucket,
-    local_path: Path,
-    gcs_path: str,
-    dry_run: bool = False
-) -> Tuple[bool, str]:
+def plan_upload(rel_path: str, product_indexes: Tuple[dict, dict]) -> Optional[int]:
     """
-    Upload image to Google Cloud Storage.
+    Decide whether an image needs uploading.
     
     Args:
-        bucket: GCS bucket object
-        local_path: Local file path
-        gcs_path: Destination path in GCS
-        dry_run: If True, don't actually upload
+        rel_path: Image path relative to IMAGES_DIR
+        product_indexes: (exact_index, suffix_index) from load_product_index
         
     Returns:
-        Tuple of (success, gcs_url or error_message)
+        Product ID to update, or None if the image is skipped
     """
+    # Find product in the preloaded indexes; stored paths may carry a
+    # "fashion-images/..." prefix, which the suffix index covers
+    product = find_product(str(rel_path), *product_indexes)
+    
+    if not product:
+        logger.debug(f"Product not found in database: {rel_path}")
+        return None
+    
+    # Check if already has GCS URL
+    if product.get('cloudinary_url') and 'storage.googleapis.com' in product['cloudinary_url']:
+        return None
+    
+    return product['id']
+
+
+def _file_size(filename: str) -> int:
+    """Return file size in bytes, or 0 if it can't be read."""
     try:
-        if not local_path.exists():
-            return False, f"File not found: {local_path}"
-        
-        if dry_run:
-            gcs_url = f"{GCS_BASE_URL}/{gcs_path}"
-            return True, gcs_url
-        
-        # Create blob with public-read permission
-        blob = bucket.blob(gcs_path)
-        
-        # Set content type based on extension
-        content_type = {
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.png': 'image/png',
-            '.webp': 'image/webp'
-        }.get(local_path.suffix.lower(), 'image/jpeg')
-        
-        # Upload file
-        blob.upload_from_filename(
-            str(local_path),
-            content_type=content_type
+        return os.path.getsize(filename)
+    except OSError:
+        return 0  # Reported by the upload itself
+
+
+def prefetch_files(filenames: list) -> None:
+    """
+    Ask the kernel to start reading files into the page cache.
+    
+    Readahead runs in the background, so disk reads for the whole batch
+    overlap with the uploads instead of stalling each upload thread.
+    No-op on platforms without posix_fadvise.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    
+    for filename in filenames:
+        try:
+            fd = os.open(filename, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass  # Missing files are reported by the upload itself
+
+
+def upload_large_file(filename: str, blob: storage.Blob) -> Optional[Exception]:
+    """
+    Upload a large file as concurrent XML multipart chunks.
+    
+    Returns:
+        None on success, otherwise the raised exception
+    """
+    try:
+        transfer_manager.upload_chunks_concurrently(
+            filename,
+            blob,
+            content_type=blob.content_type,
+            chunk_size=LARGE_FILE_SIZE,
+            worker_type=transfer_manager.THREAD,
+            max_workers=LARGE_FILE_WORKERS,
+            retry=UPLOAD_RETRY
         )
-        
-        # Make it publicly accessible (if bucket isn't already public)
-        # blob.make_public()  # Optional, only if bucket-level policy isn't set
-        
-        # Get public URL
-        gcs_url = blob.public_url
-        
-        return True, gcs_url
-        
-    except GoogleCloudError as e:
-        logger.error(f"GCS error uploading {local_path}: {e}")
-        return False, str(e)
+        return None
     except Exception as e:
-        logger.error(f"Error uploading {local_path}: {e}")
-        return False, str(e)
+        return e
 
 
-def process_image(
+def upload_batch(
     bucket: storage.Bucket,
-    local_path: Path,
-    rel_path: str,
+    batch: list,
+    max_workers: int,
     dry_run: bool = False
-) -> Tuple[bool, str]:
-    """Process a single image: upload to GCS and update database."""
-    
-    # Find product in database
-    product = get_product_by_image_path(str(rel_path))
+) -> None:
+    """
+    Upload a batch of images with the GCS transfer manager.
     
-    if not product:
-        # Try with different path formats
-        alt_paths = [
-            str(rel_path),
-            f"fashion-images/{rel_path}",
-            f"fashion-images/fashion-images/{rel_path}",
-        ]
-        
-        for alt_path in alt_paths:
-            product = get_product_by_image_path(alt_path)
-            if product:
-                break
+    Successful uploads are queued for the database writer thread.
     
-    if not product:
+    Args:
+        bucket: GCS bucket object
+        batch: List of (local_path, gcs_path, product_id) tuples
+        max_workers: Number of parallel upload threads
+        dry_run: If True, don't actually upload
+    """
+    if dry_run:
         with stats_lock:
-            stats['skipped'] += 1
-        return False, f"Product not found in database: {rel_path}"
+            stats['uploaded'] += len(batch)
+        return
     
-    # Check if already has GCS URL
-    if product.get('cloudinary_url') and 'storage.googleapis.com' in product['cloudinary_url']:
-        with stats_lock:
-            stats['skipped'] += 1
-        return True, "Already has GCS URL"
+    file_blob_pairs = []
+    for local_path, gcs_path, _ in batch:
+        blob = bucket.blob(gcs_path)
+        blob.content_type = CONTENT_TYPES.get(local_path.suffix.lower(), 'image/jpeg')
+        file_blob_pairs.append((str(local_path), blob))
     
-    # Upload to GCS
-    gcs_path = f"products/{rel_path}"
-    success, gcs_url_or_error = upload_image_to_gcs(bucket, local_path, gcs_path, dry_run)
+    prefetch_files([filename for filename, _ in file_blob_pairs])
     
-    if not success:
-        with stats_lock:
-            stats['errors'] += 1
-        return False, gcs_url_or_error
+    # Large files go up in parallel chunks; the rest as one request each
+    large_indices = {
+        i for i, (filename, _) in enumerate(file_blob_pairs)
+        if _file_size(filename) > LARGE_FILE_SIZE
+    }
+    small_indices = [i for i in range(len(file_blob_pairs)) if i not in large_indices]
+    results = [None] * len(file_blob_pairs)
     
-    # Update database
-    if not dry_run:
-        if not update_product_gcs_url(product['id'], gcs_url_or_error):
-            with stats_lock:
-                stats['errors'] += 1
-            return False, "Failed to update database"
+    try:
+        small_results = transfer_manager.upload_many(
+            [file_blob_pairs[i] for i in small_indices],
+            upload_kwargs={'retry': UPLOAD_RETRY},
+            max_workers=max_workers,
+            worker_type=transfer_manager.THREAD
+        )
+    except Exception as e:
+        small_results = [e] * len(small_indices)
     
-    with stats_lock:
-        stats['uploaded'] += 1
+    for i, result in zip(small_indices, small_results):
+        results[i] = result
+    for i in large_indices:
+        results[i] = upload_large_file(*file_blob_pairs[i])
     
-    return True, gcs_url_or_error
+    for (local_path, _, product_id), (_, blob), result in zip(batch, file_blob_pairs, results):
+        # Each result is None on success or the raised exception
+        if result is None:
+            write_queue.put((product_id, blob.public_url))
+            with stats_lock:
+                stats['uploaded'] += 1
+        else:
+            logger.error(f"Error uploading {local_path}: {result}")
+            with stats_lock:
+                stats['errors'] += 1
 
 
 def migrate_images(
-    max_workers: int = 10,
+    max_workers: int = 32,
     max_uploads: Optional[int] = None,
     dry_run: bool = False,
     project_id: Optional[str] = None,
@@ -366,20 +470,12 @@ def migrate_images(
     if dry_run:
         logger.info("DRY RUN MODE - No uploads or database changes will be made")
     
-    # Get all images
-    images = get_all_images(IMAGES_DIR)
-    
-    if not images:
-        logger.error("No images found!")
+    if not IMAGES_DIR.exists():
+        logger.error(f"Images directory not found: {IMAGES_DIR}")
         return
     
-    stats['total'] = len(images)
-    
-    if max_uploads:
-        images = images[:max_uploads]
-        logger.info(f"Limiting to {max_uploads} images for testing")
-    
-    logger.info(f"Found {len(images)} images to process")
+    # Load all products once instead of querying per image
+    product_indexes = load_product_index()
     
     # Initialize GCS
     if not dry_run:
@@ -389,6 +485,7 @@ def migrate_images(
             os.environ['GCS_BUCKET_NAME'] = actual_bucket_name
             
             client = init_gcs_client()
+            size_connection_pool(client, max_workers)
             bucket = create_bucket_if_not_exists(client, actual_bucket_name)
             
             # Make bucket public (one-time setup)
@@ -403,30 +500,69 @@ def migrate_images(
     else:
         bucket = None
     
-    # Process images in parallel
+    # Start the single database writer; upload workers only enqueue updates
+    writer_thread = None
+    existing_blobs = set()
+    if not dry_run:
+        # List uploaded objects once (1000 per page) so reruns skip them
+        existing_blobs = {
+            blob.name
+            for blob in bucket.list_blobs(prefix="products/", fields="items(name),nextPageToken")
+        }
+        logger.info(f"Found {len(existing_blobs)} objects already in bucket")
+        
+        ensure_gcs_url_column()
+        writer_thread = Thread(target=db_writer, daemon=True)
+        writer_thread.start()
+    
+    # Stream images from disk; uploads start as soon as a chunk is ready
+    logger.info(f"Scanning directory: {IMAGES_DIR}")
+    images = iter_images(IMAGES_DIR)
+    
+    if max_uploads:
+        images = islice(images, max_uploads)
+        logger.info(f"Limiting to {max_uploads} images for testing")
+    
     logger.info(f"Starting upload with {max_workers} workers...")
+    batch = []
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        futures = {
-            executor.submit(process_image, bucket, local_path, rel_path, dry_run): (local_path, rel_path)
-            for local_path, rel_path in images
-        }
+    with tqdm(desc="Uploading", unit="image") as pbar:
+        for local_path, rel_path in images:
+            stats['total'] += 1
+            product_id = plan_upload(rel_path, product_indexes)
+            
+            if product_id is None:
+                with stats_lock:
+                    stats['skipped'] += 1
+                pbar.update(1)
+                continue
+            
+            gcs_path = f"products/{rel_path}"
+            if gcs_path in existing_blobs:
+                # Already in the bucket; only the database row needs the URL
+                write_queue.put((product_id, bucket.blob(gcs_path).public_url))
+                with stats_lock:
+                    stats['uploaded'] += 1
+                pbar.update(1)
+                continue
+            
+            batch.append((local_path, gcs_path, product_id))
+            if len(batch) >= UPLOAD_CHUNK_SIZE:
+                upload_batch(bucket, batch, max_workers, dry_run)
+                pbar.update(len(batch))
+                batch = []
         
-        # Process results with progress bar
-        with tqdm(total=len(futures), desc="Uploading", unit="image") as pbar:
-            for future in as_completed(futures):
-                local_path, rel_path = futures[future]
-                try:
-                    success, message = future.result()
-                    if not success and not message.startswith("Product not found"):
-                        logger.debug(f"{'✓' if success else '✗'} {rel_path}: {message}")
-                except Exception as e:
-                    logger.error(f"Exception processing {rel_path}: {e}")
-                    with stats_lock:
-                        stats['errors'] += 1
-                finally:
-                    pbar.update(1)
+        if batch:
+            upload_batch(bucket, batch, max_workers, dry_run)
+            pbar.update(len(batch))
+    
+    if not stats['total']:
+        logger.error("No images found!")
+    
+    # Flush remaining database updates
+    if writer_thread:
+        write_queue.put(_WRITER_STOP)
+        writer_thread.join()
     
     # Print summary
     logger.info("=" * 80)
@@ -450,7 +586,7 @@ if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description='Migrate images to Google Cloud Storage')
-    parser.add_argument('--workers', type=int, default=10, help='Number of parallel workers')
+    parser.add_argument('--workers', type=int, default=32, help='Number of parallel upload threads')
     parser.add_argument('--max-uploads', type=int, help='Maximum number of images to upload (for testing)')
     parser.add_argument('--dry-run', action='store_true', help='Simulate without actual uploads')
     parser.add_argument('--project-id', type=str, help='Google Cloud Project ID (overrides .env)')
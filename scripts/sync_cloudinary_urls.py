@@ -7,12 +7,14 @@ NO UPLOADS - Only syncs existing URLs to fix the database.
 
 import os
 import sys
+import queue
 import sqlite3
 import logging
+import threading
 from pathlib import Path
 from dotenv import load_dotenv
-import cloudinary
-import cloudinary.api
+
+from cloudinary_utils import basename_sql, tune_connection
 
 # Setup logging
 logging.basicConfig(
@@ -24,6 +26,8 @@ logger = logging.getLogger(__name__)
 
 def init_cloudinary():
     """Initialize Cloudinary configuration."""
+    import cloudinary
+    
     load_dotenv()
     
     # Try CLOUDINARY_URL first (single variable format)
@@ -54,18 +58,20 @@ def init_cloudinary():
     logger.info(f"✅ Cloudinary connected - Cloud: {cloudinary.config().cloud_name}")
 
 
-def fetch_all_cloudinary_urls(folder="visual-product-matcher"):
+def iter_cloudinary_pages(folder="visual-product-matcher"):
     """
-    Fetch all image URLs from Cloudinary.
+    Yield Cloudinary images one API page at a time.
     
-    Returns:
-        dict: Mapping of filename -> cloudinary_url
+    Yields:
+        list: (filename, cloudinary_url) pairs for one page
     """
+    import cloudinary.api
+    
     logger.info(f"Fetching all images from Cloudinary folder: {folder}")
     
-    cloudinary_urls = {}
     next_cursor = None
     page = 1
+    total = 0
     
     try:
         while True:
@@ -83,11 +89,13 @@ def fetch_all_cloudinary_urls(folder="visual-product-matcher"):
             resources = result.get('resources', [])
             
             # Extract filename and URL
-            for resource in resources:
-                filename = resource['public_id'].split('/')[-1] + '.jpg'  # Add extension
-                cloudinary_urls[filename] = resource['secure_url']
-            
-            logger.info(f"    Found {len(resources)} images (Total: {len(cloudinary_urls)})")
+            batch = [
+                (resource['public_id'].split('/')[-1] + '.jpg', resource['secure_url'])  # Add extension
+                for resource in resources
+            ]
+            total += len(batch)
+            logger.info(f"    Found {len(resources)} images (Total: {total})")
+            yield batch
             
             next_cursor = result.get('next_cursor')
             if not next_cursor:
@@ -99,29 +107,77 @@ def fetch_all_cloudinary_urls(folder="visual-product-matcher"):
         logger.error(f"Error fetching from Cloudinary: {e}")
         raise
     
-    logger.info(f"✅ Fetched {len(cloudinary_urls)} URLs from Cloudinary")
+    logger.info(f"✅ Fetched {total} URLs from Cloudinary")
+
+
+def fetch_all_cloudinary_urls(folder="visual-product-matcher"):
+    """
+    Fetch all image URLs from Cloudinary.
+    
+    Returns:
+        dict: Mapping of filename -> cloudinary_url
+    """
+    cloudinary_urls = {}
+    for batch in iter_cloudinary_pages(folder):
+        cloudinary_urls.update(batch)
     return cloudinary_urls
 
 
+def prefetch(iterable, max_pending=2):
+    """
+    Run an iterator on a background thread, keeping a few items ready.
+    
+    Cloudinary pages are chained by cursor, so they can't be fetched in
+    parallel; this keeps the next request in flight while the caller
+    stores the current page.
+    
+    Args:
+        iterable: Iterable to consume
+        max_pending: Items buffered ahead of the caller
+    
+    Yields:
+        Items of iterable, in order (exceptions are re-raised here)
+    """
+    pending = queue.Queue(maxsize=max_pending)
+    done = object()
+    
+    def produce():
+        try:
+            for item in iterable:
+                pending.put((item, None))
+        except Exception as e:
+            pending.put((None, e))
+        pending.put((done, None))
+    
+    threading.Thread(target=produce, name='cloudinary-fetch', daemon=True).start()
+    
+    while True:
+        item, error = pending.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
+
+
 def update_database(db_path, cloudinary_urls):
     """
     Update database with Cloudinary URLs using EXACT path matching.
     
     Args:
         db_path: Path to SQLite database
-        cloudinary_urls: Dict mapping filename -> cloudinary_url
+        cloudinary_urls: Dict mapping filename -> cloudinary_url, or an
+            iterable of (filename, cloudinary_url) batches (e.g. pages
+            still being fetched)
     """
     logger.info(f"\nUpdating database: {db_path}")
     
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
-    updated_count = 0
-    not_found_count = 0
-    
     try:
         # Check database structure
-        cursor.execute("PRAGMA table_info(products)")
+        cursor.execute("PRAGMA table_xinfo(products)")
         columns = [col[1] for col in cursor.fetchall()]
         
         if 'cloudinary_url' not in columns:
@@ -129,43 +185,55 @@ def update_database(db_path, cloudinary_urls):
             logger.error("   Run migrate_db.py first to add the column.")
             return
         
-        # Get all products that need URLs
-        cursor.execute("""
-            SELECT id, image_path 
-            FROM products 
-            WHERE cloudinary_url IS NULL OR cloudinary_url = ''
-        """)
-        products_needing_urls = cursor.fetchall()
+        tune_connection(conn)
         
-        logger.info(f"Found {len(products_needing_urls)} products needing Cloudinary URLs")
+        needs_url = "(cloudinary_url IS NULL OR cloudinary_url = '')"
         
-        # Update each product
-        for product_id, image_path in products_needing_urls:
-            # Extract filename from path
-            filename = Path(image_path).name
-            
-            # Look up Cloudinary URL
-            if filename in cloudinary_urls:
-                cloudinary_url = cloudinary_urls[filename]
-                
-                # Update database with EXACT match (fixed SQL query)
-                cursor.execute(
-                    """UPDATE products 
-                       SET cloudinary_url = ?
-                       WHERE id = ?""",
-                    (cloudinary_url, product_id)
-                )
-                updated_count += 1
-                
-                if updated_count % 1000 == 0:
-                    logger.info(f"  Updated {updated_count} products...")
-            else:
-                not_found_count += 1
-                if not_found_count <= 10:  # Show first 10 missing
-                    logger.warning(f"  No Cloudinary URL found for: {filename}")
+        # Indexed image_basename column when the schema has it
+        basename = basename_sql(columns)
         
+        cursor.execute(f"SELECT COUNT(*) FROM products WHERE {needs_url}")
+        logger.info(f"Found {cursor.fetchone()[0]} products needing Cloudinary URLs")
+        
+        # Load the Cloudinary listing into a temp table keyed by filename,
+        # batch by batch as pages arrive; only the temp database is written
+        # here, so the app's database stays unlocked while fetching
+        if isinstance(cloudinary_urls, dict):
+            cloudinary_urls = [cloudinary_urls.items()]
+        cursor.execute("CREATE TEMP TABLE cloudinary_files (filename TEXT PRIMARY KEY, url TEXT NOT NULL)")
+        for batch in cloudinary_urls:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO cloudinary_files (filename, url) VALUES (?, ?)",
+                batch
+            )
         conn.commit()
         
+        # Update with EXACT filename matches in a single statement, so the
+        # matching runs inside SQLite as primary-key lookups
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(f"""
+                UPDATE products
+                SET cloudinary_url = (
+                    SELECT url FROM cloudinary_files
+                    WHERE filename = {basename}
+                )
+                WHERE {needs_url}
+                  AND {basename} IN (SELECT filename FROM cloudinary_files)
+            """)
+            updated_count = cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        
+        cursor.execute(f"SELECT COUNT(*) FROM products WHERE {needs_url}")
+        not_found_count = cursor.fetchone()[0]
+        
+        cursor.execute(f"SELECT {basename} FROM products WHERE {needs_url} LIMIT 10")
+        for (filename,) in cursor.fetchall():  # Show first 10 missing
+            logger.warning(f"  No Cloudinary URL found for: {filename}")
+        
         logger.info("\n" + "="*60)
         logger.info("SYNC SUMMARY")
         logger.info("="*60)
@@ -242,11 +310,9 @@ def main():
         # Step 1: Initialize Cloudinary
         init_cloudinary()
         
-        # Step 2: Fetch all URLs from Cloudinary
-        cloudinary_urls = fetch_all_cloudinary_urls()
-        
-        # Step 3: Update database
-        update_database(db_path, cloudinary_urls)
+        # Steps 2-3: Fetch URLs from Cloudinary and stage them in the
+        # database as pages arrive, then update
+        update_database(db_path, prefetch(iter_cloudinary_pages()))
         
         # Step 4: Verify
         verify_database(db_path)
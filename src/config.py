@@ -0,0 +1,68 @@
+"""
+Configuration loading for Visual Product Matcher.
+"""
+import os
+import json
+import logging
+import yaml
+
+try:
+    import orjson
+except ImportError:  # Optional: faster JSON for the config cache
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Use the libyaml-backed loader when PyYAML was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def _json_loads(data: bytes):
+    """Decode JSON bytes, using orjson when installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    """Encode an object as JSON bytes, using orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def load_config(config_path: str = "config.yaml") -> dict:
+    """
+    Load configuration from YAML file.
+
+    The parsed configuration is cached in a JSON sidecar file
+    (``<config_path>.json``). When the sidecar is newer than the YAML
+    file it is loaded instead, skipping YAML parsing entirely.
+
+    Args:
+        config_path: Path to configuration file
+
+    Returns:
+        Configuration dictionary
+    """
+    cache_path = f"{config_path}.json"
+
+    try:
+        if os.stat(cache_path).st_mtime >= os.stat(config_path).st_mtime:
+            with open(cache_path, 'rb') as f:
+                return _json_loads(f.read())
+    except (OSError, ValueError):
+        pass  # Missing or unreadable cache, fall back to YAML
+
+    with open(config_path, 'r') as f:
+        config = yaml.load(f, Loader=YAML_LOADER)
+
+    try:
+        serialized = _json_dumps(config)
+        with open(cache_path, 'wb') as f:
+            f.write(serialized)
+    except (OSError, TypeError) as e:
+        # Read-only filesystem or non-JSON values; caching is best effort
+        logger.debug(f"Could not write config cache {cache_path}: {e}")
+
+    return config
@@ -0,0 +1,66 @@
+"""
+Flask JSON provider backed by orjson for faster API responses.
+"""
+import logging
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional: faster JSON responses
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider that encodes and decodes with orjson.
+
+    Types orjson can't handle natively (Decimal, UUID, objects with
+    __html__) fall back to Flask's default conversions.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        """
+        Serialize data as JSON.
+
+        Args:
+            obj: Data to serialize
+            **kwargs: Flask dump arguments; only ``indent`` is honoured
+
+        Returns:
+            JSON string
+        """
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        """
+        Deserialize data as JSON.
+
+        Args:
+            s: Text or UTF-8 bytes
+            **kwargs: Ignored
+
+        Returns:
+            Decoded data
+        """
+        return orjson.loads(s)
+
+
+def init_json_provider(app) -> None:
+    """
+    Use orjson for request and response JSON when it is installed.
+
+    Args:
+        app: Flask application instance
+    """
+    if orjson is None:
+        logger.info("orjson not installed, using the default JSON provider")
+        return
+
+    app.json = OrjsonProvider(app)
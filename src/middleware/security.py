@@ -2,18 +2,72 @@
 Security middleware for Visual Product Matcher.
 Implements rate limiting, request validation, and security headers.
 """
+import os
 import logging
 import ipaddress
+from dataclasses import dataclass
 from functools import wraps
-from urllib.parse import urlparse
-from flask import request, jsonify, make_response
+from urllib.parse import urlsplit
+from flask import request, jsonify, make_response, has_request_context
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits.storage import storage_from_string
 from typing import Optional, Callable, Any
-import re
 
 logger = logging.getLogger(__name__)
 
+# Address ranges that must never be fetched (private, loopback, link-local,
+# CGNAT, documentation, benchmarking, multicast and reserved), stored as
+# (network, netmask) integer pairs so membership is a mask-and-compare
+def _network_masks(cidrs: tuple) -> tuple:
+    """Convert CIDR strings to (network, netmask) integer pairs."""
+    networks = [ipaddress.ip_network(cidr) for cidr in cidrs]
+    return tuple((int(net.network_address), int(net.netmask)) for net in networks)
+
+
+BLOCKED_NETWORKS_V4 = _network_masks((
+    '0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8',
+    '169.254.0.0/16', '172.16.0.0/12', '192.0.0.0/24', '192.0.2.0/24',
+    '192.168.0.0/16', '198.18.0.0/15', '198.51.100.0/24', '203.0.113.0/24',
+    '224.0.0.0/4', '240.0.0.0/4'
+))
+BLOCKED_NETWORKS_V6 = _network_masks((
+    '::/128', '::1/128', '100::/64', '2001::/23', '2001:db8::/32',
+    'fc00::/7', 'fe80::/10', 'ff00::/8'
+))
+
+# Hostnames that always resolve to the local machine
+LOCALHOST_NAMES = frozenset({'localhost', '127.0.0.1', '::1', '0.0.0.0'})
+
+# Link-local and cloud metadata prefixes, and internal domain suffixes.
+# Plain prefix/suffix checks run in linear time with no regex backtracking
+SUSPICIOUS_HOST_PREFIXES = ('169.254.', 'metadata.google.internal')
+SUSPICIOUS_HOST_SUFFIXES = ('.internal',)
+
+
+def resolve_limiter_storage(storage_uri: str) -> str:
+    """
+    Check that a shared rate limit storage backend is reachable.
+    
+    Args:
+        storage_uri: Storage URI (e.g. "redis://localhost:6379")
+    
+    Returns:
+        The given URI, or "memory://" if the backend can't be reached
+    """
+    if storage_uri.startswith('memory://'):
+        return storage_uri
+    
+    try:
+        if storage_from_string(storage_uri).check():
+            return storage_uri
+        logger.warning(f"Rate limit storage {storage_uri} is unreachable, falling back to memory://")
+    except Exception as e:
+        # Missing client library (e.g. redis) or invalid URI
+        logger.warning(f"Rate limit storage {storage_uri} unavailable ({e}), falling back to memory://")
+    
+    return 'memory://'
+
 
 def init_rate_limiter(app, config: dict) -> Optional[Limiter]:
     """
@@ -32,11 +86,15 @@ def init_rate_limiter(app, config: dict) -> Optional[Limiter]:
         logger.info("Rate limiting is disabled")
         return None
     
+    # Shared storage (Redis/Memcached) keeps limits accurate across workers
+    storage_uri = resolve_limiter_storage(rate_limit_config.get('storage_uri', 'memory://'))
+    
     try:
         limiter = Limiter(
             app=app,
             key_func=get_remote_address,
-            storage_uri=rate_limit_config.get('storage_uri', 'memory://'),
+            storage_uri=storage_uri,
+            strategy=rate_limit_config.get('strategy', 'fixed-window'),
             default_limits=[rate_limit_config.get('default', '100 per hour')],
             headers_enabled=True,
             swallow_errors=True  # Don't crash app if rate limiter fails
@@ -44,7 +102,7 @@ def init_rate_limiter(app, config: dict) -> Optional[Limiter]:
         
         logger.info(
             f"Rate limiter initialized with default limit: "
-            f"{rate_limit_config.get('default')}"
+            f"{rate_limit_config.get('default')} (storage: {storage_uri})"
         )
         return limiter
     
@@ -53,6 +111,42 @@ def init_rate_limiter(app, config: dict) -> Optional[Limiter]:
         return None
 
 
+@dataclass(frozen=True)
+class _UrlPolicy:
+    """URL validation settings resolved once from the configuration."""
+    max_length: int
+    allowed_schemes: frozenset
+    scheme_error: str
+    block_private: bool
+    
+    @classmethod
+    def from_config(cls, config: dict) -> '_UrlPolicy':
+        """Build the policy from the security.request_validation section."""
+        validation_config = config.get('security', {}).get('request_validation', {})
+        schemes = validation_config.get('allowed_url_schemes', ['http', 'https'])
+        return cls(
+            max_length=validation_config.get('max_url_length', 2048),
+            allowed_schemes=frozenset(schemes),
+            scheme_error=f"URL scheme must be one of: {', '.join(schemes)}",
+            block_private=validation_config.get('blocked_private_ips', True)
+        )
+
+
+# (config, policy) for the most recently seen configuration; the app passes
+# the same dict on every request, so this is effectively built once
+_url_policy_cache: tuple = (None, None)
+
+
+def _url_policy(config: dict) -> _UrlPolicy:
+    """Return the URL policy for a configuration, reusing the cached one."""
+    global _url_policy_cache
+    cached_config, policy = _url_policy_cache
+    if cached_config is not config:
+        policy = _UrlPolicy.from_config(config)
+        _url_policy_cache = (config, policy)
+    return policy
+
+
 def validate_url_safety(url: str, config: dict) -> tuple[bool, Optional[str]]:
     """
     Validate URL for security concerns (SSRF prevention).
@@ -64,52 +158,71 @@ def validate_url_safety(url: str, config: dict) -> tuple[bool, Optional[str]]:
     Returns:
         Tuple of (is_valid, error_message)
     """
-    validation_config = config.get('security', {}).get('request_validation', {})
+    policy = _url_policy(config)
     
     # Check URL length
-    max_length = validation_config.get('max_url_length', 2048)
-    if len(url) > max_length:
-        return False, f"URL exceeds maximum length of {max_length} characters"
+    if len(url) > policy.max_length:
+        return False, f"URL exceeds maximum length of {policy.max_length} characters"
     
     # Parse URL
     try:
-        parsed = urlparse(url)
+        parsed = urlsplit(url)
     except Exception as e:
         return False, f"Invalid URL format: {str(e)}"
     
     # Check scheme
-    allowed_schemes = validation_config.get('allowed_url_schemes', ['http', 'https'])
-    if parsed.scheme not in allowed_schemes:
-        return False, f"URL scheme must be one of: {', '.join(allowed_schemes)}"
+    if parsed.scheme not in policy.allowed_schemes:
+        return False, policy.scheme_error
     
     # Check for private IPs (SSRF prevention)
-    if validation_config.get('blocked_private_ips', True):
+    if policy.block_private:
         hostname = parsed.hostname
         if hostname:
             # Check if it's an IP address
             try:
                 ip = ipaddress.ip_address(hostname)
-                if ip.is_private or ip.is_loopback or ip.is_link_local:
+                if ip.version == 6 and ip.ipv4_mapped:
+                    ip = ip.ipv4_mapped  # e.g. ::ffff:127.0.0.1
+                blocked_networks = BLOCKED_NETWORKS_V4 if ip.version == 4 else BLOCKED_NETWORKS_V6
+                address = int(ip)
+                if any(address & netmask == network for network, netmask in blocked_networks):
                     return False, "Access to private IP addresses is not allowed"
             except ValueError:
                 # Not an IP address, check for localhost
-                if hostname.lower() in ['localhost', '127.0.0.1', '::1', '0.0.0.0']:
+                hostname = hostname.lower()
+                if hostname in LOCALHOST_NAMES:
                     return False, "Access to localhost is not allowed"
                 
                 # Check for suspicious patterns
-                suspicious_patterns = [
-                    r'169\.254\.',  # Link-local
-                    r'metadata\.google\.internal',  # Cloud metadata
-                    r'.*\.internal$',  # Internal domains
-                ]
-                
-                for pattern in suspicious_patterns:
-                    if re.match(pattern, hostname, re.IGNORECASE):
-                        return False, "Access to internal resources is not allowed"
+                if (hostname.startswith(SUSPICIOUS_HOST_PREFIXES)
+                        or hostname.endswith(SUSPICIOUS_HOST_SUFFIXES)):
+                    return False, "Access to internal resources is not allowed"
     
     return True, None
 
 
+# Upload filename extensions that are never accepted
+SUSPICIOUS_EXTENSIONS = frozenset({
+    '.exe', '.bat', '.cmd', '.sh', '.ps1', '.php', '.jsp', '.asp',
+    '.js', '.jar', '.war', '.py', '.rb', '.pl', '.cgi'
+})
+
+DEFAULT_ALLOWED_MIME_TYPES = frozenset({
+    'image/jpeg', 'image/jpg', 'image/png', 'image/webp'
+})
+
+# Leading bytes of the allowed image formats; WebP is RIFF....WEBP
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n')
+SNIFF_BYTES = 12
+
+
+def _has_image_signature(header: bytes) -> bool:
+    """Check the first bytes of an upload against known image formats."""
+    if header.startswith(IMAGE_SIGNATURES):
+        return True
+    return header[:4] == b'RIFF' and header[8:12] == b'WEBP'
+
+
 def validate_file_upload(file_storage, config: dict) -> tuple[bool, Optional[str]]:
     """
     Validate uploaded file for security.
@@ -127,36 +240,38 @@ def validate_file_upload(file_storage, config: dict) -> tuple[bool, Optional[str
     upload_config = config.get('security', {}).get('upload_safety', {})
     
     # Check file size
-    file_storage.seek(0, 2)  # Seek to end
-    file_size = file_storage.tell()
-    file_storage.seek(0)  # Reset to beginning
-    
     max_size_mb = upload_config.get('max_file_size_mb', 10)
     max_size_bytes = max_size_mb * 1024 * 1024
     
-    if file_size > max_size_bytes:
-        return False, f"File size exceeds maximum of {max_size_mb}MB"
+    # The file is only part of the request body, so a body within the limit
+    # proves the file is too and the spooled upload need not be measured
+    content_length = request.content_length if has_request_context() else None
+    if content_length is None or content_length > max_size_bytes:
+        file_storage.seek(0, 2)  # Seek to end
+        file_size = file_storage.tell()
+        file_storage.seek(0)  # Reset to beginning
+        
+        if file_size > max_size_bytes:
+            return False, f"File size exceeds maximum of {max_size_mb}MB"
     
     # Check MIME type
     content_type = file_storage.content_type
-    allowed_types = upload_config.get('allowed_mime_types', [
-        'image/jpeg', 'image/jpg', 'image/png', 'image/webp'
-    ])
+    allowed_types = upload_config.get('allowed_mime_types', DEFAULT_ALLOWED_MIME_TYPES)
     
     if content_type not in allowed_types:
         return False, f"File type '{content_type}' is not allowed"
     
+    # The declared type is client-controlled; sniff only the leading bytes
+    header = file_storage.stream.read(SNIFF_BYTES)
+    file_storage.stream.seek(0)
+    if not _has_image_signature(header):
+        return False, "File content is not a supported image format"
+    
     # Check filename for suspicious patterns
     filename = file_storage.filename
-    suspicious_extensions = [
-        '.exe', '.bat', '.cmd', '.sh', '.ps1', '.php', '.jsp', '.asp',
-        '.js', '.jar', '.war', '.py', '.rb', '.pl', '.cgi'
-    ]
-    
-    filename_lower = filename.lower()
-    for ext in suspicious_extensions:
-        if filename_lower.endswith(ext):
-            return False, f"Executable files are not allowed"
+    extension = os.path.splitext(filename.lower())[1]
+    if extension in SUSPICIOUS_EXTENSIONS:
+        return False, "Executable files are not allowed"
     
     # Check for path traversal attempts
     if '..' in filename or '/' in filename or '\\' in filename:
@@ -165,37 +280,48 @@ def validate_file_upload(file_storage, config: dict) -> tuple[bool, Optional[str
     return True, None
 
 
-def add_security_headers(response, config: dict):
+# Config key under security.headers -> response header name
+SECURITY_HEADER_NAMES = (
+    ('x_frame_options', 'X-Frame-Options'),
+    ('x_content_type_options', 'X-Content-Type-Options'),
+    ('x_xss_protection', 'X-XSS-Protection'),
+    ('strict_transport_security', 'Strict-Transport-Security'),
+    # Content-Security-Policy (optional, can be added later)
+)
+
+
+def build_security_headers(config: dict) -> tuple[tuple[str, str], ...]:
     """
-    Add security headers to response.
+    Resolve the configured security headers once.
     
     Args:
-        response: Flask response object
         config: Security configuration dictionary
     
     Returns:
-        Modified response object
+        Tuple of (header name, value) pairs
     """
     headers_config = config.get('security', {}).get('headers', {})
+    return tuple(
+        (header, headers_config[key])
+        for key, header in SECURITY_HEADER_NAMES
+        if key in headers_config
+    )
+
+
+def add_security_headers(response, headers: tuple[tuple[str, str], ...]):
+    """
+    Add security headers to response.
     
-    # X-Frame-Options
-    if 'x_frame_options' in headers_config:
-        response.headers['X-Frame-Options'] = headers_config['x_frame_options']
-    
-    # X-Content-Type-Options
-    if 'x_content_type_options' in headers_config:
-        response.headers['X-Content-Type-Options'] = headers_config['x_content_type_options']
-    
-    # X-XSS-Protection
-    if 'x_xss_protection' in headers_config:
-        response.headers['X-XSS-Protection'] = headers_config['x_xss_protection']
-    
-    # Strict-Transport-Security
-    if 'strict_transport_security' in headers_config:
-        response.headers['Strict-Transport-Security'] = headers_config['strict_transport_security']
+    Args:
+        response: Flask response object
+        headers: (name, value) pairs from build_security_headers()
     
-    # Content-Security-Policy (optional, can be added later)
-    # response.headers['Content-Security-Policy'] = "default-src 'self'"
+    Returns:
+        Modified response object
+    """
+    response_headers = response.headers
+    for name, value in headers:
+        response_headers[name] = value
     
     return response
 
@@ -210,28 +336,23 @@ def require_valid_request(config: dict):
     Returns:
         Decorator function
     """
+    # Resolved once; the wrapper only compares against these scalars
+    upload_config = config.get('security', {}).get('upload_safety', {})
+    max_size_mb = upload_config.get('max_file_size_mb', 10)
+    max_request_bytes = max_size_mb * 1024 * 1024 * 2  # Allow some overhead
+    too_large_message = f'Maximum request size is {max_size_mb}MB'
+    
     def decorator(f: Callable) -> Callable:
         @wraps(f)
         def decorated_function(*args: Any, **kwargs: Any) -> Any:
             # Check Content-Length for POST/PUT requests
-            if request.method in ['POST', 'PUT']:
+            if request.method in ('POST', 'PUT'):
                 content_length = request.content_length
-                if content_length:
-                    upload_config = config.get('security', {}).get('upload_safety', {})
-                    max_size = upload_config.get('max_file_size_mb', 10) * 1024 * 1024
-                    
-                    if content_length > max_size * 2:  # Allow some overhead
-                        return jsonify({
-                            'error': 'Request too large',
-                            'message': f'Maximum request size is {max_size // (1024 * 1024)}MB'
-                        }), 413
-            
-            # Check Content-Type for JSON endpoints
-            if request.path.startswith('/api/') and request.method == 'POST':
-                if 'multipart/form-data' not in request.content_type and \
-                   'application/json' not in request.content_type:
-                    # Allow form-data for uploads, json for other endpoints
-                    pass  # Some endpoints might not need JSON
+                if content_length and content_length > max_request_bytes:
+                    return jsonify({
+                        'error': 'Request too large',
+                        'message': too_large_message
+                    }), 413
             
             return f(*args, **kwargs)
         
@@ -247,17 +368,22 @@ def init_security_middleware(app, config: dict):
         app: Flask application instance
         config: Security configuration dictionary
     """
-    # Add security headers to all responses
+    # Add security headers to all responses; the set is fixed for the app
+    security_headers = build_security_headers(config)
+    
     @app.after_request
     def apply_security_headers(response):
-        return add_security_headers(response, config)
+        return add_security_headers(response, security_headers)
     
     # Log security events
     @app.before_request
     def log_request():
-        logger.debug(
-            f"Request: {request.method} {request.path} "
-            f"from {get_remote_address()}"
-        )
+        # Arguments are evaluated before logger.debug checks the level, so
+        # skip building the message (and resolving the client) when disabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Request: {request.method} {request.path} "
+                f"from {get_remote_address()}"
+            )
     
     logger.info("Security middleware initialized")
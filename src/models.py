@@ -1,9 +1,13 @@
 """
 Database models and data structures for Visual Product Matcher.
 """
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import datetime
-from typing import Optional
+from typing import Iterable, Optional
+from itertools import islice
+from threading import RLock
+import os
+import time
 import sqlite3
 import logging
 from pathlib import Path
@@ -28,9 +32,26 @@ class Product:
     gcs_url: Optional[str] = None
 
 
+# Explicit column list in Product field order so rows can be passed
+# positionally; SELECT * order depends on when migrations added columns
+PRODUCT_COLUMNS = ", ".join(field.name for field in fields(Product))
+
+# Filename part of image_path (after the last slash or backslash): rtrim()
+# strips the trailing non-separator characters, leaving the directory
+# prefix to remove. Backs the indexed image_basename generated column
+_SQL_IMAGE_PATH = "replace(image_path, '\\', '/')"
+IMAGE_BASENAME_SQL = (
+    f"replace({_SQL_IMAGE_PATH}, rtrim({_SQL_IMAGE_PATH}, replace({_SQL_IMAGE_PATH}, '/', '')), '')"
+)
+
+
 class Database:
     """SQLite database manager for product metadata."""
     
+    # Seconds a cached product count is served before re-counting; the table
+    # only changes on ingest, so health probes rarely need to touch SQLite
+    COUNT_CACHE_TTL = 1.0
+    
     def __init__(self, db_path: str):
         """
         Initialize database connection.
@@ -39,9 +60,68 @@ class Database:
             db_path: Path to SQLite database file
         """
         self.db_path = db_path
+        # Guards the shared connection; reads are locked too so they never
+        # see another thread's uncommitted write transaction
+        self._lock = RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        # (count, monotonic timestamp), or None when it must be recomputed
+        self._count_cache: Optional[tuple[int, float]] = None
         self._ensure_database_exists()
         self._create_tables()
     
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """
+        Shared connection, opened on first use.
+        
+        A connection must not be used across fork(), so gunicorn workers
+        forked after preload_app open their own on first access.
+        """
+        with self._lock:
+            if self._conn is None or self._conn_pid != os.getpid():
+                self._conn = self._connect()
+                self._conn_pid = os.getpid()
+            return self._conn
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection tuned for a read-mostly, multi-threaded server."""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-20000")
+        return conn
+    
+    def close(self) -> None:
+        """Refresh planner statistics if needed and close the shared connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.execute("PRAGMA optimize")
+                self._conn.close()
+                self._conn = None
+    
+    def analyze(self) -> None:
+        """
+        Gather query planner statistics.
+        
+        Run after bulk ingestion so the planner sees real index selectivity.
+        """
+        with self._lock:
+            self.conn.execute("ANALYZE")
+            self.conn.commit()
+        logger.info("Database statistics updated")
+    
+    def _has_statistics(self) -> bool:
+        """Check whether ANALYZE has ever been run on this database."""
+        with self._lock:
+            row = self.conn.execute("""
+                SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'
+            """).fetchone()
+        return row is not None
+    
     def _ensure_database_exists(self) -> None:
         """Ensure database directory exists."""
         db_dir = Path(self.db_path).parent
@@ -58,13 +138,16 @@ class Database:
             ('cloudinary_url', 'TEXT'),
             ('local_image_path', 'TEXT'),
             ('gcs_url', 'TEXT'),
+            # Computed on read, never stored, so it can't drift from
+            # image_path; its index turns filename matches into seeks
+            ('image_basename', f"TEXT GENERATED ALWAYS AS ({IMAGE_BASENAME_SQL}) VIRTUAL"),
         ]
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self._lock, self.conn as conn:
             cursor = conn.cursor()
             
-            # Get existing columns
-            cursor.execute("PRAGMA table_info(products)")
+            # Get existing columns (table_xinfo also lists generated ones)
+            cursor.execute("PRAGMA table_xinfo(products)")
             existing_columns = {row[1] for row in cursor.fetchall()}
             
             # Add missing columns
@@ -89,14 +172,22 @@ class Database:
                     CREATE INDEX IF NOT EXISTS idx_gcs_url 
                     ON products(gcs_url)
                 """)
+                # Expression index so "is this a GCS URL" checks can seek
+                # instead of scanning with a leading-wildcard LIKE
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_cloudinary_url_is_gcs 
+                    ON products(instr(cloudinary_url, 'storage.googleapis.com'))
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_image_basename 
+                    ON products(image_basename)
+                """)
             except sqlite3.OperationalError:
                 pass  # Indexes might already exist
-            
-            conn.commit()
     
     def _create_tables(self) -> None:
         """Create database tables if they don't exist."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._lock, self.conn as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS products (
@@ -120,12 +211,15 @@ class Database:
                 CREATE INDEX IF NOT EXISTS idx_image_path 
                 ON products(image_path)
             """)
-            
-            conn.commit()
-            logger.info("Database tables created successfully")
-            
-            # Run migrations to add any missing columns for existing databases
-            self._migrate_schema()
+        
+        logger.info("Database tables created successfully")
+        
+        # Run migrations to add any missing columns for existing databases
+        self._migrate_schema()
+        
+        # Databases populated before statistics were gathered get them once
+        if not self._has_statistics() and self.get_product_count() > 0:
+            self.analyze()
     
     def insert_product(self, product: Product) -> int:
         """
@@ -140,9 +234,8 @@ class Database:
         Raises:
             sqlite3.IntegrityError: If product with same image_path exists
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+        with self._lock, self.conn as conn:
+            cursor = conn.execute("""
                 INSERT INTO products 
                 (name, image_path, category, file_size, width, height, format)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -155,11 +248,54 @@ class Database:
                 product.height,
                 product.format
             ))
-            conn.commit()
             product_id = cursor.lastrowid
+            self._count_cache = None
             logger.debug(f"Inserted product {product_id}: {product.name}")
             return product_id
     
+    def insert_products(self, products: Iterable[Product], batch_size: int = 1000) -> int:
+        """
+        Insert multiple products in one transaction using batched executemany calls.
+        
+        Args:
+            products: Product objects to insert
+            batch_size: Number of rows per executemany call
+            
+        Returns:
+            Number of inserted products
+            
+        Raises:
+            sqlite3.IntegrityError: If a product with the same image_path exists
+        """
+        rows = (
+            (
+                product.name,
+                product.image_path,
+                product.category,
+                product.file_size,
+                product.width,
+                product.height,
+                product.format
+            )
+            for product in products
+        )
+        inserted = 0
+        
+        with self._lock, self.conn as conn:
+            # Take the write lock up front so concurrent ingest processes
+            # queue on busy_timeout instead of failing to upgrade mid-batch
+            conn.execute("BEGIN IMMEDIATE")
+            while batch := list(islice(rows, batch_size)):
+                conn.executemany("""
+                    INSERT INTO products 
+                    (name, image_path, category, file_size, width, height, format)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, batch)
+                inserted += len(batch)
+            self._count_cache = None
+            logger.debug(f"Inserted {inserted} products")
+            return inserted
+    
     def get_product_by_id(self, product_id: int) -> Optional[Product]:
         """
         Retrieve product by ID.
@@ -170,17 +306,36 @@ class Database:
         Returns:
             Product object or None if not found
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT * FROM products WHERE id = ?
-            """, (product_id,))
-            row = cursor.fetchone()
-            
-            if row:
-                return Product(**dict(row))
-            return None
+        with self._lock:
+            row = self.conn.execute(f"""
+                SELECT {PRODUCT_COLUMNS} FROM products WHERE id = ?
+            """, (product_id,)).fetchone()
+        
+        if row:
+            return Product(*row)
+        return None
+    
+    def get_products_by_ids(self, ids: list[int]) -> dict[int, Product]:
+        """
+        Retrieve several products by ID with a single query.
+        
+        Args:
+            ids: Product IDs
+        
+        Returns:
+            Dictionary mapping product ID to Product; missing IDs are omitted
+        """
+        if not ids:
+            return {}
+        
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id IN ({placeholders})",
+                [int(product_id) for product_id in ids]
+            ).fetchall()
+        
+        return {row[0]: Product(*row) for row in rows}
     
     def get_product_by_path(self, image_path: str) -> Optional[Product]:
         """
@@ -192,17 +347,25 @@ class Database:
         Returns:
             Product object or None if not found
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT * FROM products WHERE image_path = ?
-            """, (image_path,))
-            row = cursor.fetchone()
-            
-            if row:
-                return Product(**dict(row))
-            return None
+        with self._lock:
+            row = self.conn.execute(f"""
+                SELECT {PRODUCT_COLUMNS} FROM products WHERE image_path = ?
+            """, (image_path,)).fetchone()
+        
+        if row:
+            return Product(*row)
+        return None
+    
+    def get_product_ids_by_path(self) -> dict[str, int]:
+        """
+        Retrieve a mapping of image path to product ID for all products.
+        
+        Returns:
+            Dictionary mapping image_path to product ID
+        """
+        with self._lock:
+            cursor = self.conn.execute("SELECT image_path, id FROM products")
+            return {image_path: product_id for image_path, product_id in cursor}
     
     def get_all_products(self, limit: Optional[int] = None) -> list[Product]:
         """
@@ -214,39 +377,43 @@ class Database:
         Returns:
             List of Product objects
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
+        with self._lock:
             if limit:
-                cursor.execute("""
-                    SELECT * FROM products LIMIT ?
+                cursor = self.conn.execute(f"""
+                    SELECT {PRODUCT_COLUMNS} FROM products LIMIT ?
                 """, (limit,))
             else:
-                cursor.execute("SELECT * FROM products")
+                cursor = self.conn.execute(f"SELECT {PRODUCT_COLUMNS} FROM products")
             
             rows = cursor.fetchall()
-            return [Product(**dict(row)) for row in rows]
+        return [Product(*row) for row in rows]
     
     def get_product_count(self) -> int:
         """
         Get total number of products in database.
         
+        The count is cached for COUNT_CACHE_TTL seconds and dropped whenever
+        this instance inserts or deletes products.
+        
         Returns:
             Total product count
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM products")
-            count = cursor.fetchone()[0]
-            return count
+        with self._lock:
+            now = time.monotonic()
+            if self._count_cache is not None:
+                count, counted_at = self._count_cache
+                if now - counted_at < self.COUNT_CACHE_TTL:
+                    return count
+            
+            count = self.conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+            self._count_cache = (count, now)
+        return count
     
     def delete_all_products(self) -> None:
         """Delete all products from database (use with caution)."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM products")
-            conn.commit()
+        with self._lock, self.conn as conn:
+            conn.execute("DELETE FROM products")
+            self._count_cache = None
             logger.warning("All products deleted from database")
     
     def product_exists(self, image_path: str) -> bool:
@@ -259,10 +426,8 @@ class Database:
         Returns:
             True if product exists, False otherwise
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
+        with self._lock:
+            count = self.conn.execute("""
                 SELECT COUNT(*) FROM products WHERE image_path = ?
-            """, (image_path,))
-            count = cursor.fetchone()[0]
-            return count > 0
+            """, (image_path,)).fetchone()[0]
+        return count > 0
@@ -1,23 +1,26 @@
 """
 API routes for Visual Product Matcher.
 """
-import os
+import time
 import logging
+from functools import lru_cache
+from threading import Lock
 from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-import tempfile
 from src.middleware import validate_url_safety, validate_file_upload
 
 logger = logging.getLogger(__name__)
 
+# Upload names repeat a lot (image.jpg, photo.png); skip re-sanitizing them
+cached_secure_filename = lru_cache(maxsize=1024)(secure_filename)
+
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 
 def init_api(
     db,
     image_service,
-    embedding_service,
-    search_service,
+    ml_services,
     config
 ):
     """
@@ -26,32 +29,67 @@ def init_api(
     Args:
         db: Database instance
         image_service: ImageService instance
-        embedding_service: EmbeddingService instance
-        search_service: SearchService instance
+        ml_services: ServiceRegistry providing EmbeddingService and SearchService
         config: Configuration dictionary
     """
     
+    # Per-request settings, resolved once when the routes are built
+    search_config = config['search']
+    default_k = search_config['default_k']
+    default_threshold = search_config['default_similarity_threshold']
+    rate_limit_config = config.get('security', {}).get('rate_limit', {})
+    upload_limit = rate_limit_config.get('upload', '10 per minute')
+    search_limit = rate_limit_config.get('search', '30 per minute')
+    
+    status_ttl = config.get('performance', {}).get('status_cache_seconds', 2.0)
+    status_lock = Lock()
+    status_cache = {'expires': 0.0, 'snapshot': None}
+    
+    def get_ml_status():
+        """Get index stats and device info without forcing a model load."""
+        if not ml_services.is_loaded:
+            return {'status': 'not_loaded'}, {'status': 'not_loaded'}
+        embedding_service, search_service = ml_services.get()
+        return search_service.get_index_stats(), embedding_service.get_device_info()
+    
+    def get_status_snapshot():
+        """
+        Get (product_count, index_stats, device_info), cached briefly.
+        
+        Load balancer probes poll /health every few seconds; the snapshot
+        keeps them off the database and CUDA memory queries.
+        """
+        now = time.monotonic()
+        snapshot = status_cache['snapshot']
+        if snapshot is not None and now < status_cache['expires']:
+            return snapshot
+        
+        with status_lock:
+            if status_cache['snapshot'] is not None and now < status_cache['expires']:
+                return status_cache['snapshot']
+            
+            index_stats, device_info = get_ml_status()
+            snapshot = (db.get_product_count(), index_stats, device_info)
+            status_cache['snapshot'] = snapshot
+            status_cache['expires'] = time.monotonic() + status_ttl
+            return snapshot
+    
     @api_bp.route('/health', methods=['GET'])
     def health_check():
         """Health check endpoint."""
         try:
-            # Check database
-            db_status = db.get_product_count() >= 0
-            
-            # Check search index
-            index_stats = search_service.get_index_stats()
+            # Check database, search index and embedding service
+            product_count, index_stats, device_info = get_status_snapshot()
+            db_status = product_count >= 0
             index_status = index_stats.get('status') == 'loaded'
             
-            # Check embedding service
-            device_info = embedding_service.get_device_info()
-            
             return jsonify({
                 'status': 'healthy' if (db_status and index_status) else 'degraded',
                 'version': '1.2.0',
                 'author': 'Nilesh Kumar',
                 'database': {
                     'status': 'ok' if db_status else 'error',
-                    'product_count': db.get_product_count()
+                    'product_count': product_count
                 },
                 'search_index': index_stats,
                 'embedding_service': device_info
@@ -79,7 +117,6 @@ def init_api(
         # Get rate limiter and apply upload-specific limit
         limiter = current_app.config.get('LIMITER')
         if limiter:
-            upload_limit = config.get('security', {}).get('rate_limit', {}).get('upload', '10 per minute')
             try:
                 limiter.limit(upload_limit)(lambda: None)()
             except Exception as e:
@@ -115,10 +152,10 @@ def init_api(
                 }), 400
             
             # Get optional parameters
-            k = request.form.get('k', config['search']['default_k'], type=int)
+            k = request.form.get('k', default_k, type=int)
             threshold = request.form.get(
                 'threshold',
-                config['search']['default_similarity_threshold'],
+                default_threshold,
                 type=float
             )
             
@@ -136,19 +173,20 @@ def init_api(
                 }), 400
             
             # Process uploaded file
-            success, error, file_path = image_service.process_uploaded_file(
+            image_data, error, file_path = image_service.process_uploaded_image(
                 file,
-                secure_filename(file.filename)
+                cached_secure_filename(file.filename)
             )
             
-            if not success:
+            if image_data is None:
                 return jsonify({
                     'error': 'File upload failed',
                     'message': error
                 }), 400
             
             # Generate embedding for uploaded image
-            query_embedding = embedding_service.generate_embedding(file_path)
+            embedding_service, search_service = ml_services.get()
+            query_embedding = embedding_service.generate_embedding_from_bytes(image_data)
             
             if query_embedding is None:
                 return jsonify({
@@ -165,8 +203,9 @@ def init_api(
             
             # Get product details for results
             products = []
+            by_id = db.get_products_by_ids([product_id for product_id, _ in results])
             for product_id, similarity in results:
-                product = db.get_product_by_id(product_id)
+                product = by_id.get(product_id)
                 if product:
                     # Use GCS URL if available, then cloudinary_url, finally fallback to local path
                     image_url = product.gcs_url or product.cloudinary_url or product.image_path
@@ -214,7 +253,6 @@ def init_api(
         # Apply search rate limit
         limiter = current_app.config.get('LIMITER')
         if limiter:
-            search_limit = config.get('security', {}).get('rate_limit', {}).get('search', '30 per minute')
             try:
                 limiter.limit(search_limit)(lambda: None)()
             except Exception as e:
@@ -244,8 +282,8 @@ def init_api(
                     'message': error_message
                 }), 400
             
-            k = data.get('k', config['search']['default_k'])
-            threshold = data.get('threshold', config['search']['default_similarity_threshold'])
+            k = data.get('k', default_k)
+            threshold = data.get('threshold', default_threshold)
             
             # Validate parameters
             if k < 1 or k > 100:
@@ -260,22 +298,22 @@ def init_api(
                     'message': 'threshold must be between 0 and 1'
                 }), 400
             
-            # Download image from URL
-            temp_path = os.path.join(
-                tempfile.gettempdir(),
-                f"query_{secure_filename(os.path.basename(url))}"
+            # Download image from URL into memory. Start the download, then
+            # fetch (or cold-load) CLIP and the index while it is in flight
+            download = current_app.extensions['io_executor'].submit(
+                image_service.fetch_image_from_url, url
             )
+            embedding_service, search_service = ml_services.get()
+            image_bytes, error = download.result()
             
-            success, error = image_service.download_image_from_url(url, temp_path)
-            
-            if not success:
+            if image_bytes is None:
                 return jsonify({
                     'error': 'Image download failed',
                     'message': error
                 }), 400
             
             # Generate embedding
-            query_embedding = embedding_service.generate_embedding(temp_path)
+            query_embedding = embedding_service.generate_embedding_from_bytes(image_bytes)
             
             if query_embedding is None:
                 return jsonify({
@@ -292,8 +330,9 @@ def init_api(
             
             # Get product details
             products = []
+            by_id = db.get_products_by_ids([product_id for product_id, _ in results])
             for product_id, similarity in results:
-                product = db.get_product_by_id(product_id)
+                product = by_id.get(product_id)
                 if product:
                     # Use GCS URL if available, then cloudinary_url, finally fallback to local path
                     image_url = product.gcs_url or product.cloudinary_url or product.image_path
@@ -308,10 +347,6 @@ def init_api(
                         'height': product.height
                     })
             
-            # Cleanup temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            
             return jsonify({
                 'success': True,
                 'query_url': url,
@@ -354,7 +389,7 @@ def init_api(
                 'width': product.width,
                 'height': product.height,
                 'format': product.format,
-                'created_at': str(product.created_at) if product.created_at else None
+                'created_at': product.created_at
             }), 200
             
         except Exception as e:
@@ -368,9 +403,7 @@ def init_api(
     def get_stats():
         """Get application statistics."""
         try:
-            product_count = db.get_product_count()
-            index_stats = search_service.get_index_stats()
-            device_info = embedding_service.get_device_info()
+            product_count, index_stats, device_info = get_status_snapshot()
             
             return jsonify({
                 'products': {
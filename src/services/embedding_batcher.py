@@ -0,0 +1,117 @@
+"""
+Micro-batching of concurrent single-image embedding requests.
+"""
+import os
+import time
+import queue
+import logging
+from concurrent.futures import Future
+from threading import Lock, Thread
+from typing import Callable, Optional
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """
+    Coalesce concurrent embedding requests into batched forward passes.
+    
+    Request threads preprocess their own image and submit the tensor. A
+    single dispatcher thread takes everything queued (up to max_batch_size),
+    optionally waiting max_wait_ms for stragglers, and runs it through the
+    model as one batch. While a batch is on the device, new requests queue
+    up and form the next one, so a lone request is never delayed.
+    """
+    
+    def __init__(
+        self,
+        encode_batch: Callable[[torch.Tensor], np.ndarray],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 0.0
+    ):
+        """
+        Initialize the batcher.
+        
+        Args:
+            encode_batch: Maps an (N, C, H, W) tensor to (N, D) embeddings
+            max_batch_size: Maximum number of images per forward pass
+            max_wait_ms: How long to hold a batch open for more requests
+        """
+        self._encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._lock = Lock()
+        self._queue: Optional[queue.SimpleQueue] = None
+        self._pid: Optional[int] = None
+    
+    def _ensure_dispatcher(self) -> queue.SimpleQueue:
+        """
+        Start the dispatcher thread on first use in this process.
+        
+        Threads don't survive fork(), so gunicorn workers forked after
+        preload_app start their own.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                self._pid = os.getpid()
+                Thread(
+                    target=self._run,
+                    args=(self._queue,),
+                    name='embedding-batcher',
+                    daemon=True
+                ).start()
+            return self._queue
+    
+    def embed(self, image_tensor: torch.Tensor, timeout: Optional[float] = None) -> np.ndarray:
+        """
+        Embed one preprocessed image, batched with any concurrent requests.
+        
+        Args:
+            image_tensor: Preprocessed image tensor of shape (C, H, W)
+            timeout: Seconds to wait for the result (None waits forever)
+        
+        Returns:
+            Embedding vector
+        """
+        future = Future()
+        self._ensure_dispatcher().put((image_tensor, future))
+        return future.result(timeout=timeout)
+    
+    def _next_batch(self, pending: queue.SimpleQueue) -> list:
+        """Block for one request, then gather whatever else is queued."""
+        batch = [pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        
+        while len(batch) < self.max_batch_size:
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    batch.append(pending.get(timeout=remaining))
+                else:
+                    batch.append(pending.get_nowait())
+            except queue.Empty:
+                break
+        
+        return batch
+    
+    def _run(self, pending: queue.SimpleQueue) -> None:
+        """Dispatcher loop: encode batches and resolve their futures."""
+        while True:
+            batch = self._next_batch(pending)
+            tensors, futures = zip(*batch)
+            
+            try:
+                embeddings = self._encode_batch(torch.stack(tensors))
+            except Exception as e:
+                logger.error(f"Batched embedding of {len(batch)} images failed: {str(e)}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            
+            if len(batch) > 1:
+                logger.debug(f"Embedded {len(batch)} concurrent requests in one batch")
+            for future, embedding in zip(futures, embeddings):
+                future.set_result(embedding)
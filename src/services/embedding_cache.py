@@ -0,0 +1,106 @@
+"""
+In-process LRU cache of query embeddings keyed by image content.
+"""
+import hashlib
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU cache mapping image bytes to their embedding.
+    
+    Keys are BLAKE2b digests of the encoded image, so repeat queries for
+    the same file (re-uploads, popular URLs) skip the CLIP forward pass.
+    Cached vectors are read-only and shared between callers.
+    """
+    
+    def __init__(self, max_entries: int):
+        """
+        Initialize the cache.
+        
+        Args:
+            max_entries: Maximum number of embeddings kept before evicting
+        """
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['EmbeddingCache']:
+        """
+        Build a cache sized by performance.cache_size_mb.
+        
+        Args:
+            config: Configuration dictionary
+        
+        Returns:
+            EmbeddingCache, or None if caching is disabled
+        """
+        perf_config = config.get('performance', {})
+        if not perf_config.get('cache_enabled', False):
+            return None
+        
+        # float32 vector plus key, OrderedDict node and array header
+        entry_bytes = config['ml']['embedding_dimension'] * 4 + 256
+        max_entries = int(perf_config.get('cache_size_mb', 100) * 1024 * 1024 // entry_bytes)
+        if max_entries <= 0:
+            return None
+        
+        logger.info(f"Embedding cache enabled for up to {max_entries} images")
+        return cls(max_entries)
+    
+    @staticmethod
+    def key(data: bytes) -> bytes:
+        """Content key for encoded image bytes."""
+        return hashlib.blake2b(data, digest_size=16).digest()
+    
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        """
+        Look up an embedding, marking it most recently used.
+        
+        Args:
+            key: Content key from key()
+        
+        Returns:
+            Cached embedding or None on a miss
+        """
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+    
+    def put(self, key: bytes, embedding: np.ndarray) -> np.ndarray:
+        """
+        Store an embedding, evicting the least recently used if full.
+        
+        Args:
+            key: Content key from key()
+            embedding: Embedding vector
+        
+        Returns:
+            The stored read-only embedding
+        """
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embedding
+    
+    def __len__(self) -> int:
+        return len(self._entries)
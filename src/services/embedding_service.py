@@ -1,15 +1,65 @@
 """
 Embedding service using CLIP for semantic image understanding.
 """
+import os
 import logging
+import multiprocessing
+from io import BytesIO
 import torch
+import torch.nn.functional as F
 import numpy as np
 from PIL import Image
 from typing import List, Optional, Union
 import clip
+from torch.utils.data import DataLoader, Dataset
+from torchvision.io import ImageReadMode, decode_jpeg
+from torchvision.transforms import CenterCrop, Compose, Normalize, Resize, ToTensor
+from torchvision.transforms.v2 import functional as TF
+from src.services.embedding_batcher import EmbeddingBatcher
+from src.services.embedding_cache import EmbeddingCache
+from src.services.onnx_encoder import OnnxImageEncoder
 
 logger = logging.getLogger(__name__)
 
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+
+
+class _ImageDataset(Dataset):
+    """Image paths decoded and preprocessed on DataLoader workers."""
+    
+    def __init__(self, image_paths: List[str], preprocess):
+        self.image_paths = image_paths
+        self.preprocess = preprocess
+    
+    def __len__(self) -> int:
+        return len(self.image_paths)
+    
+    def __getitem__(self, idx: int):
+        path = self.image_paths[idx]
+        try:
+            image = Image.open(path)
+            if image.mode == 'RGBA':
+                image = image.convert('RGB')
+            return idx, self.preprocess(image)
+        except Exception as e:
+            logger.error(f"Error loading image {path}: {str(e)}")
+            return idx, None
+
+
+def _collate_images(samples):
+    """
+    Stack the images that loaded, remembering their positions.
+    
+    Returns:
+        Tuple of (valid indices, stacked tensor or None, batch length)
+    """
+    valid = [(idx, tensor) for idx, tensor in samples if tensor is not None]
+    if not valid:
+        return [], None, len(samples)
+    
+    indices, tensors = zip(*valid)
+    return list(indices), torch.stack(tensors), len(samples)
+
 
 class EmbeddingService:
     """Service for generating image embeddings using CLIP."""
@@ -32,6 +82,48 @@ class EmbeddingService:
         
         # Load CLIP model
         self.model, self.preprocess = self._load_model()
+        self._setup_fused_preprocess()
+        self._setup_gpu_jpeg_decode()
+        
+        # Image encoder: PyTorch by default, or an exported ONNX Runtime graph
+        self._encode_images = self._torch_encode_images
+        if config['ml'].get('backend', 'torch') == 'onnx':
+            onnx_encoder = OnnxImageEncoder.from_model(
+                self.model,
+                self.model_name,
+                config['ml'].get('onnx_cache_dir', 'data/models'),
+                self.device
+            )
+            if onnx_encoder is not None:
+                self._encode_images = onnx_encoder
+        
+        # CLIP already loads fp16 weights on CUDA. On CPU, int8 weights or
+        # bfloat16 autocast are opt-in: int8 needs VNNI to pay off and bfloat16
+        # needs AMX/AVX512-BF16 support
+        self._cpu_bfloat16 = False
+        if self.device.type == 'cpu':
+            if config['ml'].get('cpu_int8', False):
+                self._setup_int8(config['ml'].get('int8_max_drift', 0.01))
+            else:
+                self._cpu_bfloat16 = config['ml'].get('cpu_bfloat16', False)
+        
+        compile_mode = config['ml'].get('compile')
+        if compile_mode and self._encode_images == self._torch_encode_images:
+            self._compile_visual(compile_mode)
+        
+        # Repeat query images skip the forward pass entirely
+        self._cache = EmbeddingCache.from_config(config)
+        
+        # Coalesce concurrent single-image requests (gthread workers) into
+        # batched forward passes
+        batching_config = config['ml'].get('micro_batching', {})
+        self._batcher = None
+        if batching_config.get('enabled', False):
+            self._batcher = EmbeddingBatcher(
+                self._encode_batch,
+                max_batch_size=batching_config.get('max_batch_size', 8),
+                max_wait_ms=batching_config.get('max_wait_ms', 0.0)
+            )
         
         logger.info(f"Embedding service initialized with {self.model_name} on {self.device}")
     
@@ -70,121 +162,359 @@ class EmbeddingService:
             logger.error(f"Failed to load CLIP model: {str(e)}")
             raise
     
-    def generate_embedding(self, image_path: str) -> Optional[np.ndarray]:
+    def _setup_fused_preprocess(self) -> None:
         """
-        Generate embedding for a single image.
+        Split CLIP's preprocess into tensor resize/crop and a fused normalization.
+        
+        CLIP ends its pipeline with ToTensor (scale by 1/255, HWC -> CHW)
+        followed by Normalize. Both are folded into a single affine op on the
+        uint8 image so the pixel data is only traversed once. The leading
+        Resize and CenterCrop run on the uint8 tensor as well, which is
+        several times faster than PIL's resize.
+        """
+        self._pil_transform = None
+        self._resize = None
+        transforms = getattr(self.preprocess, 'transforms', [])
+        
+        if (len(transforms) < 2 or not isinstance(transforms[-2], ToTensor)
+                or not isinstance(transforms[-1], Normalize)):
+            logger.debug("Unexpected CLIP preprocess pipeline, using it unchanged")
+            return
+        
+        mean = torch.tensor(transforms[-1].mean, dtype=torch.float32).view(-1, 1, 1)
+        std = torch.tensor(transforms[-1].std, dtype=torch.float32).view(-1, 1, 1)
+        
+        # (x / 255 - mean) / std == x * scale - shift
+        self._norm_scale = 1.0 / (255.0 * std)
+        self._norm_shift = mean / std
+        self._pil_transform = Compose(transforms[:-2])
+        
+        if (len(transforms) >= 4 and isinstance(transforms[0], Resize)
+                and isinstance(transforms[1], CenterCrop)):
+            self._resize = transforms[0]
+            self._crop_size = list(transforms[1].size)
+            size = self._resize.size
+            self._draft_size = size if isinstance(size, int) else max(size)
+    
+    def _setup_gpu_jpeg_decode(self) -> None:
+        """Enable nvJPEG decoding of query JPEGs when running on CUDA."""
+        self._gpu_jpeg_decode = (
+            self.device.type == 'cuda'
+            and self._resize is not None
+            and self.config['ml'].get('gpu_jpeg_decode', True)
+        )
+        if self._gpu_jpeg_decode:
+            self._device_norm_scale = self._norm_scale.to(self.device)
+            self._device_norm_shift = self._norm_shift.to(self.device)
+    
+    def _compile_visual(self, mode: str) -> None:
+        """
+        Compile the vision tower with TorchInductor.
+        
+        A warm-up forward pass triggers compilation at startup instead of on
+        the first request; if compiling fails the eager module is kept.
         
         Args:
-            image_path: Path to image file
-            
-        Returns:
-            Numpy array of embedding vector or None on error
+            mode: torch.compile mode, e.g. "default" or "reduce-overhead"
         """
+        eager_visual = self.model.visual
+        resolution = eager_visual.input_resolution
+        
         try:
-            # Load and preprocess image
-            image = Image.open(image_path)
-            
-            # Convert RGBA to RGB if necessary
-            if image.mode == 'RGBA':
-                image = image.convert('RGB')
+            self.model.visual = torch.compile(eager_visual, mode=mode)
+            self._encode_batch(torch.zeros(1, 3, resolution, resolution))
+            logger.info(f"Compiled CLIP image encoder (mode={mode})")
+        except Exception as e:
+            logger.warning(f"torch.compile failed, using eager mode: {str(e)}")
+            self.model.visual = eager_visual
+    
+    def _setup_int8(self, max_drift: float) -> None:
+        """
+        Switch the image encoder to dynamically quantized int8 weights.
+        
+        The quantized encoder is compared with the float32 one on a fixed
+        probe batch and only kept if the cosine drift stays within max_drift.
+        
+        Args:
+            max_drift: Largest allowed 1 - cosine similarity per embedding
+        """
+        if isinstance(self._encode_images, OnnxImageEncoder):
+            onnx_int8 = self._encode_images.quantized()
+            if onnx_int8 is None:
+                return
+            candidate = onnx_int8
+        else:
+            quantized_visual = torch.quantization.quantize_dynamic(
+                self.model.visual, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            candidate = lambda batch: quantized_visual(batch.type(self.model.dtype))
+        
+        resolution = self.model.visual.input_resolution
+        generator = torch.Generator().manual_seed(0)
+        probe = torch.randn(4, 3, resolution, resolution, generator=generator)
+        
+        with torch.no_grad():
+            reference = F.normalize(self._encode_images(probe).float(), dim=-1)
+            quantized = F.normalize(candidate(probe).float(), dim=-1)
+        drift = 1.0 - (reference * quantized).sum(dim=-1).min().item()
+        
+        if drift > max_drift:
+            logger.warning(f"int8 encoder drift {drift:.4f} exceeds {max_drift}, keeping float32")
+            return
+        
+        if isinstance(self._encode_images, OnnxImageEncoder):
+            self._encode_images = candidate
+        else:
+            self.model.visual = quantized_visual
+        logger.info(f"Using int8 image encoder (drift {drift:.4f})")
+    
+    def _preprocess_image(self, image: Image.Image) -> torch.Tensor:
+        """
+        Preprocess a PIL image into a normalized CHW float tensor.
+        
+        Args:
+            image: PIL Image
             
-            image_input = self.preprocess(image).unsqueeze(0).to(self.device)
+        Returns:
+            Tensor of shape (3, H, W)
+        """
+        if self._pil_transform is None:
+            return self.preprocess(image)
+        
+        if self._resize is None:
+            image = self._pil_transform(image)
+            pixels = torch.from_numpy(np.array(image, dtype=np.uint8)).permute(2, 0, 1)
+            return torch.addcmul(-self._norm_shift, pixels, self._norm_scale)
+        
+        # Let libjpeg decode large JPEGs at 1/2, 1/4 or 1/8 scale, staying at
+        # or above the resize target; a no-op for other formats
+        image.draft('RGB', (self._draft_size, self._draft_size))
+        
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        pixels = torch.from_numpy(np.array(image, dtype=np.uint8)).permute(2, 0, 1)
+        return self._preprocess_pixels(pixels)
+    
+    def _preprocess_pixels(self, pixels: torch.Tensor) -> torch.Tensor:
+        """
+        Resize, crop and normalize a uint8 RGB tensor like CLIP's preprocess.
+        
+        Args:
+            pixels: uint8 tensor of shape (3, H, W) on the CPU or GPU
             
-            # Generate embedding
-            with torch.no_grad():
-                image_features = self.model.encode_image(image_input)
-                # Normalize embedding
-                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+        Returns:
+            Float tensor of shape (3, crop, crop) on the same device
+        """
+        size = self._resize.size
+        pixels = TF.resize(
+            pixels,
+            [size] if isinstance(size, int) else list(size),
+            interpolation=self._resize.interpolation,
+            antialias=True
+        )
+        pixels = TF.center_crop(pixels, self._crop_size)
+        
+        if pixels.is_cuda:
+            return torch.addcmul(-self._device_norm_shift, pixels, self._device_norm_scale)
+        return torch.addcmul(-self._norm_shift, pixels, self._norm_scale)
+    
+    def _torch_encode_images(self, image_batch: torch.Tensor) -> torch.Tensor:
+        """Run the PyTorch CLIP image encoder on a preprocessed batch."""
+        with torch.autocast('cpu', dtype=torch.bfloat16, enabled=self._cpu_bfloat16):
+            return self.model.encode_image(image_batch.to(self.device))
+    
+    def _encode_batch(self, image_batch: torch.Tensor) -> np.ndarray:
+        """
+        Run a batch of preprocessed images through CLIP.
+        
+        Args:
+            image_batch: Tensor of shape (N, 3, H, W)
             
-            # Convert to numpy array
-            embedding = image_features.cpu().numpy().flatten()
+        Returns:
+            Array of shape (N, embedding_dim) with L2-normalized rows
+        """
+        with torch.no_grad():
+            features = self._encode_images(image_batch)
+        
+        # Normalize in float32; half-precision norms lose accuracy
+        return F.normalize(features.float(), dim=-1).cpu().numpy()
+    
+    def _embed_image(self, image: Image.Image) -> np.ndarray:
+        """
+        Run a single decoded image through CLIP.
+        
+        Preprocessing happens on the calling thread; with micro-batching
+        enabled the forward pass is shared with concurrent requests.
+        
+        Args:
+            image: PIL Image
             
-            return embedding
+        Returns:
+            Normalized embedding vector
+        """
+        # Convert RGBA to RGB if necessary
+        if image.mode == 'RGBA':
+            image = image.convert('RGB')
+        
+        return self._embed_tensor(self._preprocess_image(image))
+    
+    def _embed_tensor(self, image_input: torch.Tensor) -> np.ndarray:
+        """
+        Run one preprocessed image through CLIP.
+        
+        Args:
+            image_input: Tensor of shape (3, H, W) on any device
             
-        except Exception as e:
-            logger.error(f"Error generating embedding for {image_path}: {str(e)}")
-            return None
+        Returns:
+            Normalized embedding vector
+        """
+        # Batched requests may mix CPU-preprocessed and GPU-decoded images
+        image_input = image_input.to(self.device)
+        
+        if self._batcher is not None:
+            return self._batcher.embed(image_input)
+        return self._encode_batch(image_input.unsqueeze(0))[0]
     
-    def generate_embeddings_batch(self, image_paths: List[str]) -> np.ndarray:
+    def _preprocess_jpeg_on_device(self, data: bytes) -> torch.Tensor:
         """
-        Generate embeddings for multiple images in batches.
+        Decode and preprocess a JPEG on the GPU with nvJPEG.
+        
+        The decoded tensor goes through the same tensor preprocessing as
+        CPU images, so the pixels never pass through PIL or a host-to-device
+        copy.
         
         Args:
-            image_paths: List of paths to image files
+            data: JPEG bytes
             
         Returns:
-            Numpy array of shape (n_images, embedding_dim)
+            Tensor of shape (3, H, W) on the GPU
+        """
+        raw = torch.frombuffer(bytearray(data), dtype=torch.uint8)
+        return self._preprocess_pixels(decode_jpeg(raw, mode=ImageReadMode.RGB, device=self.device))
+    
+    def _embed_encoded(self, data: bytes) -> np.ndarray:
         """
-        embeddings = []
+        Decode and embed encoded image bytes.
         
-        # Process in batches
-        for i in range(0, len(image_paths), self.batch_size):
-            batch_paths = image_paths[i:i + self.batch_size]
-            batch_embeddings = self._process_batch(batch_paths)
-            embeddings.extend(batch_embeddings)
+        JPEGs are decoded on the GPU when available; everything else, and
+        any JPEG nvJPEG rejects (e.g. CMYK), goes through PIL.
+        
+        Args:
+            data: Encoded image bytes
             
-            # Log progress
-            if (i + self.batch_size) % 100 == 0 or (i + self.batch_size) >= len(image_paths):
-                logger.info(f"Processed {min(i + self.batch_size, len(image_paths))}/{len(image_paths)} images")
+        Returns:
+            Normalized embedding vector
+        """
+        if self._gpu_jpeg_decode and data[:3] == JPEG_SIGNATURE:
+            try:
+                return self._embed_tensor(self._preprocess_jpeg_on_device(data))
+            except RuntimeError as e:
+                logger.debug(f"GPU JPEG decode failed, using PIL: {str(e)}")
         
-        return np.array(embeddings)
+        return self._embed_image(Image.open(BytesIO(data)))
     
-    def _process_batch(self, image_paths: List[str]) -> List[np.ndarray]:
+    def _embed_bytes(self, data: bytes) -> np.ndarray:
         """
-        Process a batch of images.
+        Embed encoded image bytes, consulting the embedding cache first.
         
         Args:
-            image_paths: List of image paths for the batch
+            data: Encoded image bytes
             
         Returns:
-            List of embedding arrays
+            Normalized embedding vector
         """
-        batch_embeddings = []
-        images = []
-        valid_indices = []
+        if self._cache is None:
+            return self._embed_encoded(data)
         
-        # Load and preprocess all images in batch
-        for idx, path in enumerate(image_paths):
-            try:
-                image = Image.open(path)
-                if image.mode == 'RGBA':
-                    image = image.convert('RGB')
-                images.append(self.preprocess(image))
-                valid_indices.append(idx)
-            except Exception as e:
-                logger.error(f"Error loading image {path}: {str(e)}")
-                # Add zero embedding for failed images
-                batch_embeddings.append(np.zeros(self.embedding_dim))
-        
-        if not images:
-            return batch_embeddings
+        key = self._cache.key(data)
+        embedding = self._cache.get(key)
+        if embedding is None:
+            embedding = self._cache.put(key, self._embed_encoded(data))
+        return embedding
+    
+    def generate_embedding(self, image_path: str) -> Optional[np.ndarray]:
+        """
+        Generate embedding for a single image.
         
+        Args:
+            image_path: Path to image file
+            
+        Returns:
+            Numpy array of embedding vector or None on error
+        """
         try:
-            # Stack images into batch tensor
-            image_batch = torch.stack(images).to(self.device)
+            if self._cache is None and not self._gpu_jpeg_decode:
+                return self._embed_image(Image.open(image_path))
             
-            # Generate embeddings
-            with torch.no_grad():
-                features = self.model.encode_image(image_batch)
-                # Normalize embeddings
-                features = features / features.norm(dim=-1, keepdim=True)
+            with open(image_path, 'rb') as f:
+                return self._embed_bytes(f.read())
+        except Exception as e:
+            logger.error(f"Error generating embedding for {image_path}: {str(e)}")
+            return None
+    
+    def generate_embedding_from_bytes(self, data: bytes) -> Optional[np.ndarray]:
+        """
+        Generate embedding for an image held in memory.
+        
+        Args:
+            data: Encoded image bytes (JPEG, PNG, WebP)
             
-            # Convert to numpy
-            features_np = features.cpu().numpy()
+        Returns:
+            Numpy array of embedding vector or None on error
+        """
+        try:
+            return self._embed_bytes(data)
+        except Exception as e:
+            logger.error(f"Error generating embedding from {len(data)} bytes: {str(e)}")
+            return None
+    
+    def generate_embeddings_batch(self, image_paths: List[str]) -> np.ndarray:
+        """
+        Generate embeddings for multiple images in batches.
+        
+        Args:
+            image_paths: List of paths to image files
             
-            # Insert embeddings at correct positions
-            feature_idx = 0
-            for idx in range(len(image_paths)):
-                if idx in valid_indices:
-                    batch_embeddings.insert(idx, features_np[feature_idx])
-                    feature_idx += 1
+        Returns:
+            Numpy array of shape (n_images, embedding_dim)
+        """
+        # Each batch writes straight into its rows of the result
+        embeddings = np.zeros((len(image_paths), self.embedding_dim), dtype=np.float32)
+        
+        # Worker processes decode and preprocess upcoming batches while the
+        # current one runs through the model
+        num_workers = self.config['ml'].get('loader_workers', (os.cpu_count() or 2) // 2)
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            # Workers must inherit the preprocessing state; spawning would
+            # try to pickle the whole service, so decode inline instead
+            num_workers = 0
+        pin_memory = self.device.type == 'cuda'
+        loader = DataLoader(
+            _ImageDataset(image_paths, self._preprocess_image),
+            batch_size=self.batch_size,
+            num_workers=num_workers,
+            collate_fn=_collate_images,
+            pin_memory=pin_memory,
+            prefetch_factor=2 if num_workers > 0 else None,
+            multiprocessing_context='fork' if num_workers > 0 else None
+        )
+        
+        processed = 0
+        for valid_indices, images, batch_len in loader:
+            if images is not None:
+                try:
+                    images = images.to(self.device, non_blocking=pin_memory)
+                    embeddings[valid_indices] = self._encode_batch(images)
+                except Exception as e:
+                    # Failed images keep a zero embedding
+                    logger.error(f"Error processing batch: {str(e)}")
             
-        except Exception as e:
-            logger.error(f"Error processing batch: {str(e)}")
-            # Return zero embeddings for failed batch
-            batch_embeddings = [np.zeros(self.embedding_dim) for _ in image_paths]
+            # Log progress
+            processed += batch_len
+            if processed % 100 == 0 or processed >= len(image_paths):
+                logger.info(f"Processed {processed}/{len(image_paths)} images")
         
-        return batch_embeddings
+        return embeddings
     
     def compute_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         """
@@ -197,11 +527,32 @@ class EmbeddingService:
         Returns:
             Cosine similarity score (0-1)
         """
+        return float(self.compute_similarities(embedding1, embedding2))
+    
+    @staticmethod
+    def compute_similarities(queries: np.ndarray, corpus: np.ndarray) -> np.ndarray:
+        """
+        Compute cosine similarities between query and corpus embeddings.
+        
+        One BLAS matrix product covers every pair, so scoring many vectors
+        never loops in Python.
+        
+        Args:
+            queries: Embedding of shape (D,) or (Q, D)
+            corpus: Embedding of shape (D,) or (N, D)
+            
+        Returns:
+            Scores in [0, 1] with shape queries.shape[:-1] + corpus.shape[:-1]
+        """
         # Embeddings are already normalized by CLIP, so dot product = cosine similarity
-        similarity = np.dot(embedding1, embedding2)
-        # Ensure similarity is in [0, 1] range
-        similarity = (similarity + 1) / 2  # Convert from [-1, 1] to [0, 1]
-        return float(similarity)
+        similarity = np.matmul(
+            np.asarray(queries, dtype=np.float32),
+            np.asarray(corpus, dtype=np.float32).T
+        )
+        # Convert from [-1, 1] to [0, 1] in place
+        similarity += 1.0
+        similarity *= 0.5
+        return similarity
     
     def get_device_info(self) -> dict:
         """
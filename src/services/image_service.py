@@ -2,15 +2,28 @@
 Image service for handling image upload, validation, and processing.
 """
 import os
+import re
+import time
 import logging
 from pathlib import Path
 from typing import Optional, Tuple
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from io import BytesIO
 
 logger = logging.getLogger(__name__)
 
+# Bytes read per iteration when streaming a URL download into memory
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# PIL format names accepted for uploads and downloads
+SUPPORTED_FORMATS = frozenset({'JPEG', 'PNG', 'WEBP'})
+
+# Characters removed from uploaded file names
+UNSAFE_FILENAME_CHARS = re.compile(r'[^\w-]')
+
 
 class ImageService:
     """Service for image validation, upload, and processing."""
@@ -27,6 +40,24 @@ class ImageService:
         self.temp_folder = config['upload']['temp_folder']
         self.max_file_size = config['upload']['max_file_size_mb'] * 1024 * 1024  # Convert to bytes
         self.allowed_extensions = set(config['upload']['allowed_extensions'])
+        self.resize_filter = Image.Resampling[config['upload'].get('resize_filter', 'lanczos').upper()]
+        self.strict_validate = config['upload'].get('strict_validate', False)
+        
+        # One session for URL searches so TCP/TLS connections to image hosts
+        # are kept alive between queries; sized for the download threads.
+        # Dropped connections and transient gateway errors are retried briefly
+        pool_size = config.get('performance', {}).get('io_workers', 4)
+        retry = Retry(
+            total=2,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET'}),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.http = requests.Session()
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
         
         # Create directories if they don't exist
         Path(self.upload_folder).mkdir(parents=True, exist_ok=True)
@@ -58,13 +89,37 @@ class ImageService:
         Returns:
             Tuple of (is_valid, error_message)
         """
-        try:
-            # Check file exists
-            if not os.path.exists(image_path):
-                return False, "File does not exist"
+        # Check file exists
+        if not os.path.exists(image_path):
+            return False, "File does not exist"
+        
+        return self._validate_image_source(image_path, os.path.getsize(image_path))
+    
+    def validate_image_bytes(self, data: bytes) -> Tuple[bool, Optional[str]]:
+        """
+        Validate an in-memory image's format and integrity.
+        
+        Args:
+            data: Encoded image bytes
             
+        Returns:
+            Tuple of (is_valid, error_message)
+        """
+        return self._validate_image_source(BytesIO(data), len(data))
+    
+    def _validate_image_source(self, source, file_size: int) -> Tuple[bool, Optional[str]]:
+        """
+        Check size, integrity and format of an image path or file object.
+        
+        Args:
+            source: Path to image file or seekable binary file object
+            file_size: Size of the image in bytes
+            
+        Returns:
+            Tuple of (is_valid, error_message)
+        """
+        try:
             # Check file size
-            file_size = os.path.getsize(image_path)
             if file_size > self.max_file_size:
                 max_mb = self.max_file_size / (1024 * 1024)
                 return False, f"File size exceeds maximum allowed size of {max_mb}MB"
@@ -72,14 +127,15 @@ class ImageService:
             if file_size == 0:
                 return False, "File is empty"
             
-            # Try to open and verify image
-            with Image.open(image_path) as img:
-                img.verify()
-            
-            # Open again to check format (verify() closes the file)
-            with Image.open(image_path) as img:
-                if img.format.lower() not in ['jpeg', 'jpg', 'png', 'webp']:
+            # Image.open only parses the header, which identifies the
+            # format; verify() reads the whole file (PNG CRCs, JPEG up to
+            # EOI) and is only run in strict mode. Corrupt image data is
+            # otherwise caught when the image is decoded for embedding
+            with Image.open(source) as img:
+                if img.format not in SUPPORTED_FORMATS:
                     return False, f"Unsupported image format: {img.format}"
+                if self.strict_validate:
+                    img.verify()
             
             return True, None
             
@@ -87,60 +143,61 @@ class ImageService:
             logger.error(f"Error validating image: {str(e)}")
             return False, f"Invalid image file: {str(e)}"
     
-    def download_image_from_url(self, url: str, save_path: str) -> Tuple[bool, Optional[str]]:
+    def fetch_image_from_url(self, url: str) -> Tuple[Optional[bytes], Optional[str]]:
         """
-        Download image from URL.
+        Download an image from a URL into memory.
         
         Args:
             url: URL to download image from
-            save_path: Path to save downloaded image
             
         Returns:
-            Tuple of (success, error_message)
+            Tuple of (image_bytes, error_message)
         """
         try:
             # Validate URL format
             if not url.startswith(('http://', 'https://')):
-                return False, "Invalid URL format"
+                return None, "Invalid URL format"
             
-            # Download with timeout
-            response = requests.get(url, timeout=10, stream=True)
-            response.raise_for_status()
-            
-            # Check content type
-            content_type = response.headers.get('content-type', '')
-            if not content_type.startswith('image/'):
-                return False, f"URL does not point to an image (content-type: {content_type})"
-            
-            # Check size before downloading fully
-            content_length = response.headers.get('content-length')
-            if content_length and int(content_length) > self.max_file_size:
-                max_mb = self.max_file_size / (1024 * 1024)
-                return False, f"Image size exceeds maximum allowed size of {max_mb}MB"
+            max_mb = self.max_file_size / (1024 * 1024)
             
-            # Save image
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            # Download with timeout
+            with self.http.get(url, timeout=10, stream=True) as response:
+                response.raise_for_status()
+                
+                # Check content type
+                content_type = response.headers.get('content-type', '')
+                if not content_type.startswith('image/'):
+                    return None, f"URL does not point to an image (content-type: {content_type})"
+                
+                # Check size before downloading fully
+                content_length = response.headers.get('content-length')
+                if content_length and int(content_length) > self.max_file_size:
+                    return None, f"Image size exceeds maximum allowed size of {max_mb}MB"
+                
+                # Read into memory, stopping early if the server under-reported
+                buffer = BytesIO()
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    buffer.write(chunk)
+                    if buffer.tell() > self.max_file_size:
+                        return None, f"Image size exceeds maximum allowed size of {max_mb}MB"
+            
+            data = buffer.getvalue()
             
             # Validate downloaded image
-            is_valid, error = self.validate_image_file(save_path)
+            is_valid, error = self.validate_image_bytes(data)
             if not is_valid:
-                # Clean up invalid file
-                if os.path.exists(save_path):
-                    os.remove(save_path)
-                return False, error
+                return None, error
             
-            logger.info(f"Successfully downloaded image from URL to {save_path}")
-            return True, None
+            logger.info(f"Successfully downloaded {len(data)} bytes from URL")
+            return data, None
             
         except requests.exceptions.Timeout:
-            return False, "Request timeout - URL took too long to respond"
+            return None, "Request timeout - URL took too long to respond"
         except requests.exceptions.RequestException as e:
-            return False, f"Failed to download image: {str(e)}"
+            return None, f"Failed to download image: {str(e)}"
         except Exception as e:
             logger.error(f"Error downloading image: {str(e)}")
-            return False, f"Error downloading image: {str(e)}"
+            return None, f"Error downloading image: {str(e)}"
     
     def process_uploaded_file(self, file_storage, filename: str) -> Tuple[bool, Optional[str], Optional[str]]:
         """
@@ -153,32 +210,49 @@ class ImageService:
         Returns:
             Tuple of (success, error_message, saved_path)
         """
+        data, error, save_path = self.process_uploaded_image(file_storage, filename)
+        return data is not None, error, save_path
+    
+    def process_uploaded_image(
+        self,
+        file_storage,
+        filename: str
+    ) -> Tuple[Optional[bytes], Optional[str], Optional[str]]:
+        """
+        Validate an upload in memory, save it, and hand back its bytes.
+        
+        The upload is read once; callers embed the returned bytes instead
+        of reopening the saved file, and invalid images never reach disk.
+        
+        Args:
+            file_storage: FileStorage object from Flask
+            filename: Desired filename
+            
+        Returns:
+            Tuple of (image_bytes, error_message, saved_path)
+        """
         try:
             # Validate filename extension
             if not self.validate_extension(filename):
-                return False, "Invalid file extension", None
+                return None, "Invalid file extension", None
+            
+            data = file_storage.stream.read()
+            is_valid, error = self.validate_image_bytes(data)
+            if not is_valid:
+                return None, error, None
             
-            # Generate safe filename
+            # Generate safe filename and save the validated bytes
             safe_filename = self._generate_safe_filename(filename)
             save_path = os.path.join(self.upload_folder, safe_filename)
-            
-            # Save file
-            file_storage.save(save_path)
-            
-            # Validate saved image
-            is_valid, error = self.validate_image_file(save_path)
-            if not is_valid:
-                # Clean up invalid file
-                if os.path.exists(save_path):
-                    os.remove(save_path)
-                return False, error, None
+            with open(save_path, 'wb') as f:
+                f.write(data)
             
             logger.info(f"Successfully processed uploaded file: {safe_filename}")
-            return True, None, save_path
+            return data, None, save_path
             
         except Exception as e:
             logger.error(f"Error processing uploaded file: {str(e)}")
-            return False, f"Error processing file: {str(e)}", None
+            return None, f"Error processing file: {str(e)}", None
     
     def resize_image(self, image_path: str, max_size: Tuple[int, int] = (224, 224)) -> Image.Image:
         """
@@ -192,12 +266,15 @@ class ImageService:
             Resized PIL Image object
         """
         with Image.open(image_path) as img:
-            # Convert RGBA to RGB if necessary
-            if img.mode == 'RGBA':
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale (no-op for other formats)
+            img.draft('RGB', max_size)
+            
+            # Convert RGBA, palette and CMYK images to RGB
+            if img.mode not in ('RGB', 'L'):
                 img = img.convert('RGB')
             
             # Resize maintaining aspect ratio
-            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+            img.thumbnail(max_size, self.resize_filter)
             return img.copy()
     
     def get_image_metadata(self, image_path: str) -> dict:
@@ -234,20 +311,24 @@ class ImageService:
         Returns:
             Safe filename with timestamp
         """
-        import time
         name, ext = os.path.splitext(filename)
         # Remove potentially dangerous characters
-        safe_name = "".join(c for c in name if c.isalnum() or c in ('-', '_'))
+        safe_name = UNSAFE_FILENAME_CHARS.sub('', name)
         timestamp = int(time.time())
         return f"{safe_name}_{timestamp}{ext}"
     
     def cleanup_temp_files(self) -> None:
         """Remove all temporary files."""
         try:
-            temp_path = Path(self.temp_folder)
-            for file in temp_path.glob('*'):
-                if file.is_file():
-                    file.unlink()
+            # DirEntry caches the file type from the directory read, so no
+            # per-file stat; files may vanish under us while uploads finish
+            with os.scandir(self.temp_folder) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        try:
+                            os.unlink(entry.path)
+                        except OSError as e:
+                            logger.debug(f"Could not remove temp file {entry.name}: {str(e)}")
             logger.info("Cleaned up temporary files")
         except Exception as e:
             logger.error(f"Error cleaning up temp files: {str(e)}")
@@ -262,7 +343,6 @@ class ImageService:
         Returns:
             Number of files deleted
         """
-        import time
         deleted_count = 0
         
         try:
@@ -0,0 +1,153 @@
+"""
+ONNX Runtime execution of the CLIP image encoder.
+"""
+import copy
+import logging
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import torch
+
+try:
+    import onnxruntime as ort
+except ImportError:  # Optional: ml.backend = "onnx"
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+
+class OnnxImageEncoder:
+    """
+    Runs CLIP's vision tower through an optimized ONNX Runtime session.
+    
+    The tower is exported once per model name and cached on disk; later
+    loads only build the inference session.
+    """
+    
+    def __init__(self, onnx_path: str, device: torch.device):
+        """
+        Create an inference session for an exported vision tower.
+        
+        Args:
+            onnx_path: Path to the exported .onnx file
+            device: Device the service was configured for
+        """
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        
+        providers = ['CPUExecutionProvider']
+        if device.type == 'cuda':
+            providers.insert(0, 'CUDAExecutionProvider')
+        
+        self.onnx_path = Path(onnx_path)
+        self.device = device
+        self.session = ort.InferenceSession(onnx_path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        logger.info(f"ONNX Runtime image encoder loaded ({', '.join(self.session.get_providers())})")
+    
+    @classmethod
+    def from_model(
+        cls,
+        model,
+        model_name: str,
+        cache_dir: str,
+        device: torch.device
+    ) -> Optional['OnnxImageEncoder']:
+        """
+        Load (exporting first if needed) the ONNX encoder for a CLIP model.
+        
+        Args:
+            model: Loaded CLIP model
+            model_name: CLIP variant name, used in the cache file name
+            cache_dir: Directory holding exported models
+            device: Device the service was configured for
+        
+        Returns:
+            OnnxImageEncoder, or None if ONNX Runtime is unavailable or the
+            export fails (callers fall back to PyTorch)
+        """
+        if ort is None:
+            logger.warning("ml.backend is 'onnx' but onnxruntime is not installed, using PyTorch")
+            return None
+        
+        safe_name = model_name.replace('/', '-').replace('@', '-')
+        onnx_path = Path(cache_dir) / f"clip_{safe_name}_visual.onnx"
+        
+        try:
+            if not onnx_path.exists():
+                cls.export(model.visual, onnx_path)
+            return cls(str(onnx_path), device)
+        except Exception as e:
+            logger.warning(f"ONNX image encoder unavailable ({e}), using PyTorch")
+            return None
+    
+    @staticmethod
+    def export(visual: torch.nn.Module, onnx_path: Path) -> None:
+        """
+        Export a CLIP vision tower to ONNX with a dynamic batch axis.
+        
+        Args:
+            visual: CLIP vision tower (model.visual)
+            onnx_path: Destination file
+        """
+        onnx_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        # Export a float32 CPU copy so the file runs on any provider
+        visual = copy.deepcopy(visual).float().cpu().eval()
+        resolution = visual.input_resolution
+        dummy_input = torch.zeros(1, 3, resolution, resolution)
+        
+        # Write to a temporary name so a failed export never leaves a
+        # truncated file that later loads would trust
+        partial_path = onnx_path.with_suffix('.onnx.partial')
+        with torch.no_grad():
+            torch.onnx.export(
+                visual,
+                dummy_input,
+                str(partial_path),
+                input_names=['input'],
+                output_names=['embedding'],
+                dynamic_axes={'input': {0: 'batch'}, 'embedding': {0: 'batch'}},
+                opset_version=17
+            )
+        partial_path.replace(onnx_path)
+        logger.info(f"Exported CLIP image encoder to {onnx_path}")
+    
+    def quantized(self) -> Optional['OnnxImageEncoder']:
+        """
+        Load an int8 (dynamically quantized) copy of this encoder.
+        
+        The quantized model is written next to the float32 export on first
+        use and reused afterwards.
+        
+        Returns:
+            OnnxImageEncoder running int8 weights, or None if quantization fails
+        """
+        int8_path = self.onnx_path.with_suffix('.int8.onnx')
+        
+        try:
+            if not int8_path.exists():
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                
+                partial_path = int8_path.with_suffix('.partial')
+                quantize_dynamic(str(self.onnx_path), str(partial_path), weight_type=QuantType.QInt8)
+                partial_path.replace(int8_path)
+                logger.info(f"Quantized ONNX image encoder to {int8_path}")
+            return OnnxImageEncoder(str(int8_path), self.device)
+        except Exception as e:
+            logger.warning(f"ONNX int8 quantization failed: {str(e)}")
+            return None
+    
+    def __call__(self, image_batch: torch.Tensor) -> torch.Tensor:
+        """
+        Encode a batch of preprocessed images.
+        
+        Args:
+            image_batch: Tensor of shape (N, 3, H, W)
+        
+        Returns:
+            Float32 tensor of shape (N, embedding_dim)
+        """
+        inputs = image_batch.detach().cpu().numpy().astype(np.float32, copy=False)
+        features = self.session.run(None, {self.input_name: inputs})[0]
+        return torch.from_numpy(features)
@@ -0,0 +1,134 @@
+"""
+Lazy registry for the ML services (CLIP embeddings and FAISS search).
+"""
+import os
+import logging
+from threading import Lock
+from typing import TYPE_CHECKING, Optional, Tuple
+
+# The services pull in CLIP, torchvision and FAISS; they are imported on
+# first load so app startup (and workers with preloading disabled) skip them
+if TYPE_CHECKING:
+    from src.services.embedding_service import EmbeddingService
+    from src.services.search_service import SearchService
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceRegistry:
+    """Builds the embedding and search services on first use."""
+
+    def __init__(self, config: dict):
+        """
+        Initialize registry without loading any models.
+
+        Args:
+            config: Configuration dictionary
+        """
+        self.config = config
+        self._lock = Lock()
+        self._embedding_service: Optional['EmbeddingService'] = None
+        self._search_service: Optional['SearchService'] = None
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the services have been initialized."""
+        return self._search_service is not None
+
+    def get(self) -> Tuple['EmbeddingService', 'SearchService']:
+        """
+        Get the ML services, loading them on the first call.
+
+        Concurrent first calls block on a lock so the model and index
+        are only loaded once.
+
+        Returns:
+            Tuple of (embedding_service, search_service)
+        """
+        if self._search_service is None:
+            with self._lock:
+                if self._search_service is None:
+                    self._load()
+        return self._embedding_service, self._search_service
+
+    def can_preload(self) -> bool:
+        """
+        Whether the services may be loaded before gunicorn forks workers.
+        
+        CUDA cannot be re-initialized in a forked child, so a model placed
+        on the GPU by the master would break every worker; GPU deployments
+        load lazily in each worker instead. Preloading (and the shared
+        memory it brings) only applies to CPU deployments.
+        
+        Returns:
+            True unless the model would be placed on a CUDA device
+        """
+        if self.config['ml'].get('device') != 'cuda':
+            return True
+        
+        # Ask NVML rather than the CUDA runtime, so the check itself does not
+        # initialize CUDA in the master process
+        os.environ.setdefault('PYTORCH_NVML_BASED_CUDA_CHECK', '1')
+        import torch
+        return not torch.cuda.is_available()
+    
+    @staticmethod
+    def _share_model_memory(embedding_service: 'EmbeddingService') -> None:
+        """
+        Move CPU model weights into shared memory for multi-worker gunicorn.
+        
+        Workers forked after preload_app then reuse the weights instead of
+        copying pages on write. Skipped for a single worker, where it only
+        costs /dev/shm space.
+        """
+        try:
+            workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+        except ValueError:
+            workers = 1
+        
+        if workers <= 1 or embedding_service.device.type != 'cpu':
+            return
+        
+        try:
+            embedding_service.model.share_memory()
+            logger.info(f"CLIP weights moved to shared memory for {workers} workers")
+        except (RuntimeError, OSError) as e:
+            # e.g. /dev/shm too small (64MB by default in Docker)
+            logger.warning(f"Could not share CLIP weights between workers: {e}")
+    
+    def _load(self) -> None:
+        """Load CLIP model and FAISS search index."""
+        from src.services.embedding_service import EmbeddingService
+        from src.services.search_service import SearchService
+        
+        logger.info("Initializing ML services...")
+        embedding_service = EmbeddingService(self.config)
+        self._share_model_memory(embedding_service)
+        search_service = SearchService(self.config)
+
+        # Load or build search index
+        if self.config['index']['rebuild_on_startup']:
+            logger.warning("Index rebuild on startup is enabled but not implemented here")
+            logger.warning("Run init_data.py to build the index")
+        else:
+            if search_service.index_exists():
+                logger.info("Loading existing search index...")
+                if search_service.load_index():
+                    logger.info("Search index loaded successfully")
+                    index_stats = search_service.get_index_stats()
+                    logger.info(f"Index contains {index_stats['num_products']} products")
+                else:
+                    logger.error("Failed to load search index")
+                    logger.warning("Run init_data.py to build the index")
+            else:
+                logger.warning("Search index not found")
+                logger.warning("Run init_data.py to build the index")
+
+        # Log device info
+        device_info = embedding_service.get_device_info()
+        logger.info(f"Using device: {device_info['device']}")
+        logger.info(f"Model: {device_info['model']}")
+
+        # Publish search service last; it doubles as the "loaded" flag
+        self._embedding_service = embedding_service
+        self._search_service = search_service
@@ -3,10 +3,19 @@ Search service using FAISS for efficient similarity search.
 """
 import logging
 import numpy as np
-import faiss
 import json
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import TYPE_CHECKING, List, Tuple, Optional
+
+try:
+    import orjson
+except ImportError:  # Optional: faster metadata save/load
+    orjson = None
+
+# faiss is imported where it is used, so importing this module (e.g. to
+# build the service registry) doesn't load the native library
+if TYPE_CHECKING:
+    import faiss
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +23,12 @@ logger = logging.getLogger(__name__)
 class SearchService:
     """Service for FAISS-based similarity search."""
     
+    # Maximum number of vectors used to train quantizer-based indexes
+    TRAIN_SAMPLE_SIZE = 100_000
+    
+    # Vectors converted, normalized and added to the index per step
+    ADD_CHUNK_SIZE = 10_000
+    
     def __init__(self, config: dict):
         """
         Initialize search service.
@@ -27,9 +42,22 @@ class SearchService:
         self.metadata_cache = config['index']['metadata_cache_path']
         self.embedding_dim = config['ml']['embedding_dimension']
         self.default_k = config['search']['default_k']
+        self.index_factory = config['index'].get('factory', 'SQfp16')
+        self.nprobe = config['index'].get('nprobe', 16)
+        self.ef_construction = config['index'].get('ef_construction', 200)
+        self.ef_search = config['index'].get('ef_search', 64)
+        self.prenormalized = config['ml'].get('embeddings_prenormalized', False)
+        
+        # FAISS parallelizes each search with OpenMP. The web app pins OpenMP
+        # to one thread per worker (see app.py); batch jobs can raise it here
+        num_threads = config['search'].get('num_threads')
+        if num_threads:
+            import faiss
+            faiss.omp_set_num_threads(num_threads)
         
-        self.index: Optional[faiss.Index] = None
+        self.index: Optional['faiss.Index'] = None
         self.product_ids: List[int] = []
+        self._product_id_array = np.empty(0, dtype=np.int64)
         self.embeddings: Optional[np.ndarray] = None
         
         # Ensure directories exist
@@ -46,31 +74,91 @@ class SearchService:
             embeddings: Numpy array of shape (n_products, embedding_dim)
             product_ids: List of product IDs corresponding to embeddings
         """
+        import faiss
+        
         if len(embeddings) == 0:
             raise ValueError("Cannot build index with empty embeddings")
         
         if len(embeddings) != len(product_ids):
             raise ValueError(f"Embeddings count ({len(embeddings)}) must match product IDs count ({len(product_ids)})")
         
-        # Normalize embeddings for cosine similarity
-        embeddings = embeddings.astype('float32')
-        faiss.normalize_L2(embeddings)
+        # Work on fixed-size chunks from here on so peak memory stays at one
+        # chunk plus the index, even for memory-mapped or float16 inputs
+        embeddings = np.asarray(embeddings)
+        chunk_size = self.ADD_CHUNK_SIZE
         
         # Create FAISS index
-        # Using IndexFlatL2 for exact search (good for up to 1M vectors)
-        # For larger datasets, consider IndexIVFFlat
-        self.index = faiss.IndexFlatL2(self.embedding_dim)
+        # "SQfp16" scans float16 vectors (half the memory traffic of "Flat"
+        # with the same rankings); "SQ8" quarters it. "HNSW32" gives
+        # sub-linear graph search, and larger catalogs can use a compressed
+        # factory such as "IVF4096_HNSW32,PQ64"
+        self.index = faiss.index_factory(
+            self.embedding_dim, self.index_factory, faiss.METRIC_INNER_PRODUCT
+        )
+        
+        # HNSW graph quality is fixed at build time
+        hnsw = getattr(self.index, 'hnsw', None)
+        if hnsw is not None:
+            hnsw.efConstruction = self.ef_construction
         
-        # Add embeddings to index
-        self.index.add(embeddings)
+        # Quantizer-based indexes (IVF, PQ) must be trained before adding
+        if not self.index.is_trained:
+            train_embeddings = embeddings
+            if len(embeddings) > self.TRAIN_SAMPLE_SIZE:
+                sample = np.random.default_rng(0).choice(
+                    len(embeddings), self.TRAIN_SAMPLE_SIZE, replace=False
+                )
+                train_embeddings = embeddings[np.sort(sample)]
+            train_embeddings = self._normalized(train_embeddings)
+            logger.info(f"Training {self.index_factory} index on {len(train_embeddings)} vectors")
+            self.index.train(train_embeddings)
+        
+        # Add embeddings to index, keeping the corpus copy in half
+        # precision (the index holds its own)
+        self.embeddings = np.empty((len(embeddings), self.embedding_dim), dtype=np.float16)
+        for start in range(0, len(embeddings), chunk_size):
+            chunk = self._normalized(embeddings[start:start + chunk_size])
+            self.index.add(chunk)
+            self.embeddings[start:start + len(chunk)] = chunk
+        self._configure_index()
         
-        self.embeddings = embeddings
         self.product_ids = product_ids
+        self._product_id_array = np.asarray(product_ids, dtype=np.int64)
         
         logger.info(f"Built FAISS index with {len(product_ids)} products")
     
+    def _normalized(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Convert embeddings to float32 unit vectors for the index.
+        
+        Inner product of unit vectors is cosine similarity. Unit vectors
+        from the embedding service are used as-is after a check (zero rows
+        are images that failed to embed); anything else is normalized on a
+        copy, leaving the caller's array untouched.
+        
+        Args:
+            embeddings: Array of shape (n, embedding_dim)
+        
+        Returns:
+            Float32 array of normalized embeddings
+        """
+        import faiss
+        
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.prenormalized:
+            norms = np.linalg.norm(embeddings, axis=1)
+            if np.all((np.abs(norms - 1.0) < 1e-3) | (norms == 0)):
+                return embeddings
+            logger.warning("Embeddings are not unit-norm despite embeddings_prenormalized, normalizing")
+        
+        embeddings = np.array(embeddings, dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+        return embeddings
+    
     def save_index(self) -> None:
         """Save FAISS index and metadata to disk."""
+        import faiss
+        
         if self.index is None:
             raise ValueError("No index to save. Build index first.")
         
@@ -87,10 +175,17 @@ class SearchService:
             metadata = {
                 'product_ids': self.product_ids,
                 'embedding_dim': self.embedding_dim,
-                'num_products': len(self.product_ids)
+                'num_products': len(self.product_ids),
+                'metric': 'inner_product'
             }
-            with open(self.metadata_cache, 'w') as f:
-                json.dump(metadata, f)
+            if orjson is not None:
+                # Serializes the int64 id array directly, without a Python list
+                metadata['product_ids'] = self._product_id_array
+                with open(self.metadata_cache, 'wb') as f:
+                    f.write(orjson.dumps(metadata, option=orjson.OPT_SERIALIZE_NUMPY))
+            else:
+                with open(self.metadata_cache, 'w') as f:
+                    json.dump(metadata, f)
             logger.info(f"Saved metadata to {self.metadata_cache}")
             
         except Exception as e:
@@ -104,6 +199,8 @@ class SearchService:
         Returns:
             True if successfully loaded, False otherwise
         """
+        import faiss
+        
         try:
             # Check if files exist
             if not Path(self.index_path).exists():
@@ -114,20 +211,28 @@ class SearchService:
                 logger.warning(f"Metadata file not found: {self.metadata_cache}")
                 return False
             
-            # Load FAISS index
-            self.index = faiss.read_index(self.index_path)
+            # Load FAISS index memory-mapped so pages are read on demand and
+            # shared between processes through the page cache
+            self.index = faiss.read_index(
+                self.index_path,
+                faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            )
+            self._configure_index()
             logger.info(f"Loaded FAISS index from {self.index_path}")
             
-            # Load embeddings if available
+            # Memory-map embeddings if available; pages are faulted in on
+            # demand and shared between workers through the page cache
             if Path(self.embeddings_cache).exists():
-                self.embeddings = np.load(self.embeddings_cache)
+                self.embeddings = np.load(self.embeddings_cache, mmap_mode='r')
                 logger.info(f"Loaded embeddings from {self.embeddings_cache}")
             
             # Load metadata
-            with open(self.metadata_cache, 'r') as f:
-                metadata = json.load(f)
+            with open(self.metadata_cache, 'rb') as f:
+                data = f.read()
+            metadata = orjson.loads(data) if orjson is not None else json.loads(data)
             
             self.product_ids = metadata['product_ids']
+            self._product_id_array = np.asarray(self.product_ids, dtype=np.int64)
             logger.info(f"Loaded metadata with {len(self.product_ids)} products")
             
             return True
@@ -136,6 +241,19 @@ class SearchService:
             logger.error(f"Error loading index: {str(e)}")
             return False
     
+    def _configure_index(self) -> None:
+        """Apply search-time parameters to the current index."""
+        import faiss
+        
+        try:
+            faiss.extract_index_ivf(self.index).nprobe = self.nprobe
+        except RuntimeError:
+            pass  # Not an IVF index
+        
+        hnsw = getattr(self.index, 'hnsw', None)
+        if hnsw is not None:
+            hnsw.efSearch = self.ef_search
+    
     def search(
         self,
         query_embedding: np.ndarray,
@@ -153,40 +271,62 @@ class SearchService:
         Returns:
             List of tuples (product_id, similarity_score)
         """
+        return self.search_batch(query_embedding, k, similarity_threshold)[0]
+    
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        k: Optional[int] = None,
+        similarity_threshold: float = 0.0
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        Search for similar products for several queries in one FAISS call.
+        
+        Args:
+            query_embeddings: Query embeddings of shape (B, D), or one vector
+            k: Number of results per query (default: from config)
+            similarity_threshold: Minimum similarity score (0-1)
+            
+        Returns:
+            One list of (product_id, similarity_score) tuples per query
+        """
+        import faiss
+        
         if self.index is None:
             raise ValueError("Index not loaded. Call load_index() or build_index() first.")
         
         k = k or self.default_k
         
-        # Ensure query embedding is correct shape and type
-        query_embedding = query_embedding.astype('float32').reshape(1, -1)
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.embedding_dim)
         
-        # Normalize query embedding
-        faiss.normalize_L2(query_embedding)
+        # Normalize all queries at once, on a copy: normalization is in place
+        # and cached query embeddings are read-only
+        if not self.prenormalized:
+            query_embeddings = query_embeddings.copy()
+            faiss.normalize_L2(query_embeddings)
         
         # Search - get more results than k to filter by threshold
         search_k = min(k * 3, len(self.product_ids))
-        distances, indices = self.index.search(query_embedding, search_k)
+        distances, indices = self.index.search(query_embeddings, search_k)
         
-        # Convert L2 distances to cosine similarities
-        # For normalized vectors: similarity = 1 - (L2_distance^2 / 2)
-        similarities = 1 - (distances[0] ** 2) / 2
+        # Inner-product indexes score cosine similarity directly; indexes
+        # built before the switch return squared L2 distances, and for
+        # normalized vectors similarity = 1 - squared_distance / 2
+        similarities = distances
+        if self.index.metric_type == faiss.METRIC_L2:
+            similarities = 1 - similarities / 2
         
-        # Filter and prepare results
-        results = []
-        for idx, similarity in zip(indices[0], similarities):
-            if idx == -1:  # FAISS returns -1 for empty slots
-                continue
-            
-            if similarity >= similarity_threshold:
-                product_id = self.product_ids[idx]
-                results.append((product_id, float(similarity)))
-            
-            if len(results) >= k:
-                break
+        # Filter and prepare results with one mask over the whole batch
+        # (FAISS returns -1 for empty slots)
+        keep = (indices != -1) & (similarities >= similarity_threshold)
+        batch_results = []
+        for row_indices, row_similarities, row_keep in zip(indices, similarities, keep):
+            row_ids = self._product_id_array[row_indices[row_keep][:k]]
+            row_scores = row_similarities[row_keep][:k]
+            batch_results.append(list(zip(row_ids.tolist(), row_scores.tolist())))
         
-        logger.debug(f"Found {len(results)} similar products")
-        return results
+        logger.debug(f"Searched {len(batch_results)} queries")
+        return batch_results
     
     def get_index_stats(self) -> dict:
         """
@@ -4,6 +4,7 @@ Pytest configuration and fixtures for Visual Product Matcher tests.
 import pytest
 import tempfile
 import os
+from io import BytesIO
 from pathlib import Path
 import numpy as np
 from PIL import Image
@@ -17,10 +18,17 @@ from src.services.image_service import ImageService
 from src.services.embedding_service import EmbeddingService
 from src.services.search_service import SearchService
 
+# Encoded test JPEGs keyed by (width, height, color); most tests use the
+# default image, so it is only encoded once per session
+_JPEG_CACHE = {}
 
-@pytest.fixture
-def test_config():
-    """Test configuration."""
+
+def _build_test_config(tmp_path_factory):
+    """Build a test configuration with its own temporary directories."""
+    root = tmp_path_factory.mktemp('config')
+    (root / 'uploads').mkdir()
+    (root / 'temp').mkdir()
+    
     return {
         'app': {
             'name': 'Test App',
@@ -30,8 +38,8 @@ def test_config():
         'upload': {
             'max_file_size_mb': 5,
             'allowed_extensions': ['jpg', 'jpeg', 'png', 'webp'],
-            'upload_folder': tempfile.mkdtemp(),
-            'temp_folder': tempfile.mkdtemp()
+            'upload_folder': str(root / 'uploads'),
+            'temp_folder': str(root / 'temp')
         },
         'ml': {
             'clip_model': 'ViT-B/32',
@@ -51,9 +59,9 @@ def test_config():
             'echo': False
         },
         'index': {
-            'faiss_index_path': os.path.join(tempfile.mkdtemp(), 'test.index'),
-            'embeddings_cache_path': os.path.join(tempfile.mkdtemp(), 'test_embeddings.npy'),
-            'metadata_cache_path': os.path.join(tempfile.mkdtemp(), 'test_metadata.json'),
+            'faiss_index_path': str(root / 'test.index'),
+            'embeddings_cache_path': str(root / 'test_embeddings.npy'),
+            'metadata_cache_path': str(root / 'test_metadata.json'),
             'rebuild_on_startup': False
         },
         'products': {
@@ -63,12 +71,19 @@ def test_config():
     }
 
 
+@pytest.fixture
+def test_config(tmp_path_factory):
+    """Test configuration."""
+    return _build_test_config(tmp_path_factory)
+
+
 @pytest.fixture
 def temp_db():
     """Temporary in-memory database."""
     db = Database(':memory:')
     yield db
-    # Cleanup happens automatically with in-memory database
+    # Release the connection now rather than whenever it is garbage collected
+    db.close()
 
 
 @pytest.fixture
@@ -89,46 +104,73 @@ def sample_product():
 @pytest.fixture
 def create_test_image():
     """Factory fixture to create test images."""
+    created = []
+    
     def _create_image(width=100, height=100, color=(255, 0, 0)):
         """Create a test image."""
-        img = Image.new('RGB', (width, height), color=color)
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-        img.save(temp_file.name, 'JPEG')
-        temp_file.close()
+        key = (width, height, tuple(color))
+        if key not in _JPEG_CACHE:
+            buffer = BytesIO()
+            Image.new('RGB', (width, height), color=color).save(buffer, 'JPEG')
+            _JPEG_CACHE[key] = buffer.getvalue()
+        
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
+            temp_file.write(_JPEG_CACHE[key])
+        created.append(temp_file.name)
         return temp_file.name
     
     yield _create_image
+    
+    for path in created:
+        if os.path.exists(path):
+            os.remove(path)
 
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def sample_embedding():
-    """Sample embedding vector for testing."""
+    """Sample embedding vector for testing (shared, read-only)."""
     # Create a normalized random embedding
-    embedding = np.random.randn(512).astype('float32')
-    embedding = embedding / np.linalg.norm(embedding)
+    embedding = np.random.default_rng(1).standard_normal(512, dtype=np.float32)
+    embedding /= np.linalg.norm(embedding)
+    embedding.setflags(write=False)
     return embedding
 
 
-@pytest.fixture
+@pytest.fixture(scope='session')
 def mock_embeddings():
-    """Mock embeddings for multiple products."""
+    """Mock embeddings for multiple products (shared, read-only)."""
     # Create 10 normalized random embeddings
-    embeddings = np.random.randn(10, 512).astype('float32')
-    for i in range(len(embeddings)):
-        embeddings[i] = embeddings[i] / np.linalg.norm(embeddings[i])
+    embeddings = np.random.default_rng(0).standard_normal((10, 512), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings.setflags(write=False)
     return embeddings
 
 
+@pytest.fixture(scope='session')
+def _session_services(tmp_path_factory):
+    """ImageService and SearchService built once for the whole run."""
+    config = _build_test_config(tmp_path_factory)
+    return ImageService(config), SearchService(config)
+
+
+def _restore_after_test(service):
+    """Yield a shared service, then undo any attribute changes the test made."""
+    state = dict(vars(service))
+    yield service
+    vars(service).clear()
+    vars(service).update(state)
+
+
 @pytest.fixture
-def image_service(test_config):
-    """ImageService instance for testing."""
-    return ImageService(test_config)
+def image_service(_session_services):
+    """ImageService instance for testing (shared, reset after each test)."""
+    yield from _restore_after_test(_session_services[0])
 
 
 @pytest.fixture
-def search_service(test_config):
-    """SearchService instance for testing."""
-    return SearchService(test_config)
+def search_service(_session_services):
+    """SearchService instance for testing (shared, reset after each test)."""
+    yield from _restore_after_test(_session_services[1])
 
 
 # Mock for EmbeddingService to avoid loading CLIP in tests
@@ -138,20 +180,21 @@ class MockEmbeddingService:
     def __init__(self, config):
         self.config = config
         self.embedding_dim = config['ml']['embedding_dimension']
+        self.rng = np.random.default_rng(0)
     
     def generate_embedding(self, image_path):
         """Generate mock embedding."""
-        embedding = np.random.randn(self.embedding_dim).astype('float32')
-        embedding = embedding / np.linalg.norm(embedding)
-        return embedding
+        return self.generate_embeddings_batch([image_path])[0]
+    
+    def generate_embedding_from_bytes(self, data):
+        """Generate mock embedding for in-memory image bytes."""
+        return self.generate_embedding(None)
     
     def generate_embeddings_batch(self, image_paths):
         """Generate mock embeddings batch."""
-        embeddings = []
-        for _ in image_paths:
-            embedding = self.generate_embedding(None)
-            embeddings.append(embedding)
-        return np.array(embeddings)
+        embeddings = self.rng.standard_normal((len(image_paths), self.embedding_dim), dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
     
     def get_device_info(self):
         """Get mock device info."""
@@ -0,0 +1,68 @@
+"""
+Tests for EmbeddingBatcher.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+import time
+import numpy as np
+import pytest
+import torch
+
+from src.services.embedding_batcher import EmbeddingBatcher
+
+
+def test_embed_single_request():
+    """Test that a lone request is encoded as a batch of one."""
+    batch_sizes = []
+    
+    def encode(batch):
+        batch_sizes.append(len(batch))
+        return batch.flatten(1).numpy()
+    
+    batcher = EmbeddingBatcher(encode)
+    embedding = batcher.embed(torch.full((1, 2, 2), 3.0), timeout=5)
+    
+    assert batch_sizes == [1]
+    np.testing.assert_array_equal(embedding, np.full(4, 3.0))
+
+
+def test_concurrent_requests_share_a_batch():
+    """Test that requests queued behind a busy forward pass are coalesced."""
+    started = Event()
+    release = Event()
+    batch_sizes = []
+    
+    def encode(batch):
+        batch_sizes.append(len(batch))
+        started.set()
+        release.wait(5)  # The first batch occupies the "device"
+        return batch.flatten(1).numpy()
+    
+    batcher = EmbeddingBatcher(encode, max_batch_size=8)
+    
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(batcher.embed, torch.zeros(1), 5)]
+        assert started.wait(5)
+        futures += [
+            pool.submit(batcher.embed, torch.full((1,), float(i)), 5)
+            for i in range(1, 5)
+        ]
+        deadline = time.monotonic() + 5
+        while batcher._queue.qsize() < 4 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        results = [future.result() for future in futures]
+    
+    assert [float(r[0]) for r in results] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert batch_sizes == [1, 4]
+
+
+def test_encode_errors_reach_every_caller():
+    """Test that a failed forward pass raises in the waiting request."""
+    def encode(batch):
+        raise RuntimeError('out of memory')
+    
+    batcher = EmbeddingBatcher(encode)
+    
+    with pytest.raises(RuntimeError, match='out of memory'):
+        batcher.embed(torch.zeros(3), timeout=5)
@@ -0,0 +1,46 @@
+"""
+Tests for EmbeddingCache.
+"""
+import numpy as np
+
+from src.services.embedding_cache import EmbeddingCache
+
+
+def test_get_put_round_trip():
+    """Test that a stored embedding is returned read-only on a hit."""
+    cache = EmbeddingCache(max_entries=2)
+    key = cache.key(b'image-bytes')
+    
+    assert cache.get(key) is None
+    stored = cache.put(key, np.ones(4, dtype=np.float64))
+    
+    cached = cache.get(key)
+    assert cached is stored
+    assert cached.dtype == np.float32
+    assert cached.flags.writeable is False
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted():
+    """Test that the oldest untouched entry is dropped when full."""
+    cache = EmbeddingCache(max_entries=2)
+    first, second, third = (cache.key(bytes([i])) for i in range(3))
+    
+    cache.put(first, np.zeros(2))
+    cache.put(second, np.zeros(2))
+    cache.get(first)  # first is now most recently used
+    cache.put(third, np.zeros(2))
+    
+    assert len(cache) == 2
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+
+
+def test_from_config(test_config):
+    """Test sizing from performance settings and disabling."""
+    test_config['performance'] = {'cache_enabled': True, 'cache_size_mb': 1}
+    cache = EmbeddingCache.from_config(test_config)
+    assert cache.max_entries == 1024 * 1024 // (512 * 4 + 256)
+    
+    test_config['performance']['cache_enabled'] = False
+    assert EmbeddingCache.from_config(test_config) is None
@@ -3,7 +3,11 @@ Tests for ImageService.
 """
 import pytest
 import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from threading import Thread
 from PIL import Image
+from werkzeug.datastructures import FileStorage
 
 
 def test_validate_extension(image_service):
@@ -38,7 +42,10 @@ def test_validate_image_file_not_exists(image_service):
 
 def test_validate_image_file_too_large(image_service, create_test_image):
     """Test validation of oversized file."""
-    image_path = create_test_image(width=5000, height=5000)
+    image_path = create_test_image()
+    # Only the size on disk matters; pad a small JPEG past the limit
+    with open(image_path, 'ab') as f:
+        f.write(b'\0' * 2000)
     
     try:
         # Mock smaller max size
@@ -56,6 +63,21 @@ def test_validate_image_file_too_large(image_service, create_test_image):
             os.remove(image_path)
 
 
+def test_validate_image_bytes(image_service):
+    """Test validation of an in-memory image."""
+    buffer = BytesIO()
+    Image.new('RGB', (50, 50), color=(0, 0, 255)).save(buffer, 'PNG')
+    
+    assert image_service.validate_image_bytes(buffer.getvalue()) == (True, None)
+    
+    is_valid, error = image_service.validate_image_bytes(b'')
+    assert is_valid is False
+    assert 'empty' in error.lower()
+    
+    is_valid, _ = image_service.validate_image_bytes(b'not an image')
+    assert is_valid is False
+
+
 def test_get_image_metadata(image_service, create_test_image):
     """Test extracting image metadata."""
     image_path = create_test_image(width=200, height=150)
@@ -93,3 +115,145 @@ def test_generate_safe_filename(image_service):
     assert '.jpg' in filename
     assert 'test' in filename.lower()
     assert ' ' not in filename  # Spaces should be removed/replaced
+
+
+@pytest.fixture
+def image_server():
+    """
+    Local HTTP server; maps paths to (body, send Content-Length[, status])
+    tuples, or to a list of them served in turn.
+    """
+    routes = {}
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            route = routes[self.path]
+            if isinstance(route, list):
+                route = route.pop(0)
+            body, send_length, status = (route + (200,))[:3]
+            self.send_response(status)
+            self.send_header('Content-Type', 'image/png')
+            if send_length:
+                self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", routes
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_image_from_url(image_service, image_server):
+    """Test downloading a valid image into memory."""
+    base_url, routes = image_server
+    buffer = BytesIO()
+    Image.new('RGB', (20, 20)).save(buffer, 'PNG')
+    routes['/ok.png'] = (buffer.getvalue(), True)
+    
+    data, error = image_service.fetch_image_from_url(f"{base_url}/ok.png")
+    
+    assert error is None
+    assert data == buffer.getvalue()
+
+
+def test_fetch_image_from_url_too_large(image_service, image_server):
+    """Test that oversized bodies are refused with and without Content-Length."""
+    base_url, routes = image_server
+    image_service.max_file_size = 1000
+    routes['/declared.png'] = (b'\x00' * 5000, True)
+    routes['/streamed.png'] = (b'\x00' * 5000, False)
+    
+    for path in ('/declared.png', '/streamed.png'):
+        data, error = image_service.fetch_image_from_url(base_url + path)
+        assert data is None
+        assert 'exceeds' in error
+
+
+def test_fetch_image_from_url_retries_gateway_errors(image_service, image_server):
+    """Test that transient 503s are retried on the pooled session."""
+    base_url, routes = image_server
+    buffer = BytesIO()
+    Image.new('RGB', (20, 20)).save(buffer, 'PNG')
+    routes['/flaky.png'] = [(b'', True, 503), (buffer.getvalue(), True)]
+    
+    data, error = image_service.fetch_image_from_url(f"{base_url}/flaky.png")
+    
+    assert error is None
+    assert data == buffer.getvalue()
+
+
+def test_process_uploaded_image(image_service):
+    """Test that uploads are validated in memory and saved once."""
+    buffer = BytesIO()
+    Image.new('RGB', (50, 50), color=(0, 0, 255)).save(buffer, 'PNG')
+    upload = FileStorage(stream=BytesIO(buffer.getvalue()), filename='query.png')
+    
+    data, error, save_path = image_service.process_uploaded_image(upload, 'query.png')
+    
+    try:
+        assert error is None
+        assert data == buffer.getvalue()
+        with open(save_path, 'rb') as f:
+            assert f.read() == data
+    finally:
+        if save_path and os.path.exists(save_path):
+            os.remove(save_path)
+
+
+def test_process_uploaded_image_invalid_not_saved(image_service):
+    """Test that invalid uploads never reach the upload folder."""
+    before = set(os.listdir(image_service.upload_folder))
+    upload = FileStorage(stream=BytesIO(b'not an image'), filename='query.jpg')
+    
+    data, error, save_path = image_service.process_uploaded_image(upload, 'query.jpg')
+    
+    assert data is None
+    assert save_path is None
+    assert 'invalid image' in error.lower()
+    assert set(os.listdir(image_service.upload_folder)) == before
+
+
+def test_validate_image_bytes_unsupported_format(image_service):
+    """Test that decodable images in other formats are rejected."""
+    buffer = BytesIO()
+    Image.new('RGB', (20, 20)).save(buffer, 'GIF')
+    
+    is_valid, error = image_service.validate_image_bytes(buffer.getvalue())
+    
+    assert is_valid is False
+    assert 'GIF' in error
+
+
+def test_cleanup_temp_files(image_service):
+    """Test that temp files are removed while subdirectories are kept."""
+    temp_folder = image_service.temp_folder
+    for name in ('a.jpg', 'b.png'):
+        with open(os.path.join(temp_folder, name), 'wb') as f:
+            f.write(b'data')
+    os.mkdir(os.path.join(temp_folder, 'keep'))
+    
+    image_service.cleanup_temp_files()
+    
+    assert os.listdir(temp_folder) == ['keep']
+
+
+def test_validate_image_bytes_strict(image_service):
+    """Test that full integrity checks only run in strict mode."""
+    buffer = BytesIO()
+    Image.new('RGB', (50, 50), color=(0, 255, 0)).save(buffer, 'PNG')
+    data = bytearray(buffer.getvalue())
+    # Corrupt the IDAT chunk's CRC; the header still parses
+    crc_offset = data.index(b'IEND') - 8
+    data[crc_offset] ^= 0xFF
+    
+    assert image_service.validate_image_bytes(bytes(data)) == (True, None)
+    
+    image_service.strict_validate = True
+    is_valid, error = image_service.validate_image_bytes(bytes(data))
+    assert is_valid is False
+    assert 'invalid image' in error.lower()
@@ -0,0 +1,27 @@
+"""
+Tests for the data initialization script.
+"""
+from scripts.init_data import normalize_image_path, populate_database, scan_images
+
+
+def test_normalize_image_path():
+    """Test that scanned paths are stored without a leading './'."""
+    assert normalize_image_path('./fashion-images/a.jpg') == 'fashion-images/a.jpg'
+    assert normalize_image_path('fashion-images/a.jpg') == 'fashion-images/a.jpg'
+
+
+def test_populate_database_current_directory(temp_db, image_service, create_test_image, tmp_path, monkeypatch):
+    """Test images_directory '.' stores the same paths on every run."""
+    image_dir = tmp_path / 'fashion-images'
+    image_dir.mkdir()
+    (image_dir / 'red_shirt.jpg').write_bytes(open(create_test_image(), 'rb').read())
+    monkeypatch.chdir(tmp_path)
+    
+    image_paths = scan_images('.', ['jpg'])
+    mappings = populate_database(temp_db, image_paths, '.', image_service)
+    
+    assert temp_db.get_product_ids_by_path() == {'fashion-images/red_shirt.jpg': mappings[0][0]}
+    
+    # A re-run must find the existing product instead of inserting it again
+    assert populate_database(temp_db, image_paths, '.', image_service) == mappings
+    assert temp_db.get_product_count() == 1
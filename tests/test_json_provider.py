@@ -0,0 +1,36 @@
+"""
+Tests for the orjson-backed Flask JSON provider.
+"""
+import numpy as np
+import pytest
+from flask import Flask, jsonify, request
+
+from src.json_provider import init_json_provider
+
+orjson = pytest.importorskip('orjson')
+
+
+@pytest.fixture
+def app():
+    """Flask app using the orjson provider."""
+    app = Flask(__name__)
+    init_json_provider(app)
+    return app
+
+
+def test_jsonify_round_trip(app):
+    """Test that responses encode like Flask's provider and parse back."""
+    payload = {'b': [1, 2.5, None], 'a': 'ü', 'similarity': np.float32(0.5)}
+    
+    with app.app_context():
+        response = jsonify(payload)
+    
+    assert response.mimetype == 'application/json'
+    assert response.get_data(as_text=True).startswith('{"a":"ü","b"')
+    assert app.json.loads(response.get_data()) == {'a': 'ü', 'b': [1, 2.5, None], 'similarity': 0.5}
+
+
+def test_request_json_parsing(app):
+    """Test that request bodies are decoded by the provider."""
+    with app.test_request_context('/', method='POST', json={'url': 'https://example.com/a.jpg', 'k': 5}):
+        assert request.get_json() == {'url': 'https://example.com/a.jpg', 'k': 5}
@@ -2,7 +2,9 @@
 Tests for Database models.
 """
 import pytest
-from src.models import Product
+import sqlite3
+from dataclasses import replace
+from src.models import Database, Product
 
 
 def test_database_initialization(temp_db):
@@ -43,14 +45,10 @@ def test_get_product_by_path(temp_db, sample_product):
 def test_get_all_products(temp_db, sample_product):
     """Test retrieving all products."""
     # Insert multiple products
-    for i in range(5):
-        product = Product(
-            id=0,
-            name=f'Product {i}',
-            image_path=f'/path/to/image{i}.jpg',
-            category='Fashion'
-        )
-        temp_db.insert_product(product)
+    temp_db.insert_products(
+        replace(sample_product, name=f'Product {i}', image_path=f'/path/to/image{i}.jpg')
+        for i in range(5)
+    )
     
     products = temp_db.get_all_products()
     
@@ -60,14 +58,10 @@ def test_get_all_products(temp_db, sample_product):
 def test_get_all_products_with_limit(temp_db, sample_product):
     """Test retrieving products with limit."""
     # Insert multiple products
-    for i in range(10):
-        product = Product(
-            id=0,
-            name=f'Product {i}',
-            image_path=f'/path/to/image{i}.jpg',
-            category='Fashion'
-        )
-        temp_db.insert_product(product)
+    temp_db.insert_products(
+        replace(sample_product, name=f'Product {i}', image_path=f'/path/to/image{i}.jpg')
+        for i in range(10)
+    )
     
     products = temp_db.get_all_products(limit=3)
     
@@ -107,3 +101,92 @@ def test_delete_all_products(temp_db, sample_product):
     temp_db.delete_all_products()
     
     assert temp_db.get_product_count() == 0
+
+
+def test_insert_products_batch(temp_db):
+    """Test inserting products in batches."""
+    products = [
+        Product(id=0, name=f'Product {i}', image_path=f'/path/to/image{i}.jpg')
+        for i in range(5)
+    ]
+    
+    inserted = temp_db.insert_products(products, batch_size=2)
+    
+    assert inserted == 5
+    assert temp_db.get_product_count() == 5
+
+
+def test_insert_products_rolls_back_on_error(temp_db):
+    """Test that a failing batch insert leaves no partial rows behind."""
+    products = (
+        Product(id=0, name=f'Product {i}', image_path=f'/path/to/image{i % 3}.jpg')
+        for i in range(5)
+    )
+    
+    with pytest.raises(sqlite3.IntegrityError):
+        temp_db.insert_products(products, batch_size=2)
+    
+    assert temp_db.get_product_count() == 0
+
+
+def test_get_product_ids_by_path(temp_db, sample_product):
+    """Test mapping image paths to product IDs."""
+    product_id = temp_db.insert_product(sample_product)
+    
+    assert temp_db.get_product_ids_by_path() == {sample_product.image_path: product_id}
+
+
+def test_get_products_by_ids(temp_db, sample_product):
+    """Test fetching several products with one query."""
+    first_id = temp_db.insert_product(sample_product)
+    sample_product.image_path = '/path/to/other.jpg'
+    second_id = temp_db.insert_product(sample_product)
+    
+    by_id = temp_db.get_products_by_ids([second_id, first_id, 9999])
+    
+    assert set(by_id) == {first_id, second_id}
+    assert by_id[second_id].image_path == '/path/to/other.jpg'
+    assert temp_db.get_products_by_ids([]) == {}
+
+
+def test_get_product_count_cached(tmp_path, sample_product):
+    """Test that the count is cached until this instance writes."""
+    db_path = str(tmp_path / 'products.db')
+    db = Database(db_path)
+    assert db.get_product_count() == 0
+    
+    # Writes through another connection are not seen until the TTL expires
+    other = Database(db_path)
+    other.insert_product(sample_product)
+    other.close()
+    assert db.get_product_count() == 0
+    
+    sample_product.image_path = '/path/to/other.jpg'
+    db.insert_product(sample_product)
+    assert db.get_product_count() == 2
+    db.close()
+
+
+def test_analyze_on_open(tmp_path, sample_product):
+    """Test that statistics are gathered for populated databases without them."""
+    db_path = str(tmp_path / 'products.db')
+    db = Database(db_path)
+    assert db._has_statistics() is False
+    db.insert_product(sample_product)
+    db.close()
+    
+    reopened = Database(db_path)
+    assert reopened._has_statistics() is True
+    reopened.close()
+
+
+def test_image_basename_column(temp_db, sample_product):
+    """Test that the generated filename column is indexed and tracks image_path."""
+    temp_db.insert_product(replace(sample_product, image_path='C:\\images\\shoes/red.jpg'))
+    
+    conn = temp_db.conn
+    assert conn.execute("SELECT image_basename FROM products").fetchone()[0] == 'red.jpg'
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM products WHERE image_basename = ?", ('red.jpg',)
+    ).fetchall()
+    assert any('idx_image_basename' in row['detail'] for row in plan)
@@ -0,0 +1,23 @@
+"""
+Tests for ServiceRegistry.
+"""
+import torch
+
+from src.services.registry import ServiceRegistry
+
+
+def test_can_preload_cpu(test_config):
+    """Test that CPU models may be loaded before gunicorn forks."""
+    assert ServiceRegistry(test_config).can_preload() is True
+
+
+def test_can_preload_cuda(test_config, monkeypatch):
+    """Test that models bound for a GPU are left to each worker."""
+    test_config['ml']['device'] = 'cuda'
+    
+    monkeypatch.setattr(torch.cuda, 'is_available', lambda: True)
+    assert ServiceRegistry(test_config).can_preload() is False
+    
+    # Falls back to CPU on hosts without a GPU, so preloading is safe
+    monkeypatch.setattr(torch.cuda, 'is_available', lambda: False)
+    assert ServiceRegistry(test_config).can_preload() is True
@@ -2,7 +2,9 @@
 Tests for SearchService.
 """
 import pytest
+import faiss
 import numpy as np
+from src.services.search_service import SearchService
 
 
 def test_build_index(search_service, mock_embeddings):
@@ -15,6 +17,19 @@ def test_build_index(search_service, mock_embeddings):
     assert len(search_service.product_ids) == 10
 
 
+def test_build_index_with_trained_factory(search_service, mock_embeddings, sample_embedding):
+    """Test building an index type that requires training."""
+    search_service.index_factory = 'IVF2,Flat'
+    product_ids = list(range(1, 11))
+    
+    search_service.build_index(mock_embeddings, product_ids)
+    
+    assert search_service.index.is_trained
+    assert search_service.index.ntotal == 10
+    assert search_service.index.nprobe == search_service.nprobe
+    assert len(search_service.search(sample_embedding, k=5)) <= 5
+
+
 def test_build_index_empty_embeddings(search_service):
     """Test building index with empty embeddings."""
     with pytest.raises(ValueError, match="empty"):
@@ -102,3 +117,117 @@ def test_save_and_load_index(search_service, mock_embeddings, tmp_path):
     assert loaded is True
     assert len(new_service.product_ids) == 10
     assert new_service.index is not None
+    assert isinstance(new_service.embeddings, np.memmap)
+    assert new_service.embeddings.shape == mock_embeddings.shape
+
+
+def test_half_precision_index_matches_flat(search_service, mock_embeddings, sample_embedding):
+    """Test that the float16 index ranks like exact search."""
+    product_ids = list(range(1, 11))
+    
+    search_service.index_factory = 'Flat'
+    search_service.build_index(mock_embeddings, product_ids)
+    exact = search_service.search(sample_embedding, k=5)
+    
+    search_service.index_factory = 'SQfp16'
+    search_service.build_index(mock_embeddings, product_ids)
+    half = search_service.search(sample_embedding, k=5)
+    
+    assert [pid for pid, _ in half] == [pid for pid, _ in exact]
+    assert search_service.embeddings.dtype == np.float16
+
+
+def test_build_hnsw_index(search_service, mock_embeddings, tmp_path):
+    """Test that HNSW indexes get their build and search parameters."""
+    search_service.index_factory = 'HNSW32'
+    search_service.index_path = str(tmp_path / 'test.index')
+    search_service.embeddings_cache = str(tmp_path / 'embeddings.npy')
+    search_service.metadata_cache = str(tmp_path / 'metadata.json')
+    product_ids = list(range(1, 11))
+    
+    search_service.build_index(mock_embeddings, product_ids)
+    
+    assert search_service.index.hnsw.efConstruction == search_service.ef_construction
+    assert search_service.index.hnsw.efSearch == search_service.ef_search
+    assert search_service.search(mock_embeddings[3], k=1)[0][0] == 4
+    
+    search_service.save_index()
+    assert search_service.load_index() is True
+    assert search_service.index.hnsw.efSearch == search_service.ef_search
+
+
+def test_search_scores_are_cosine_similarity(search_service, mock_embeddings):
+    """Test that scores equal cosine similarity, including for legacy L2 indexes."""
+    product_ids = list(range(1, 11))
+    search_service.index_factory = 'Flat'
+    search_service.build_index(mock_embeddings, product_ids)
+    
+    normalized = mock_embeddings / np.linalg.norm(mock_embeddings, axis=1, keepdims=True)
+    expected = normalized @ normalized[0]
+    
+    results = search_service.search(mock_embeddings[0], k=10, similarity_threshold=-1.0)
+    assert results[0] == (1, pytest.approx(1.0, abs=1e-5))
+    for product_id, similarity in results:
+        assert similarity == pytest.approx(expected[product_id - 1], abs=1e-5)
+    
+    # Indexes saved before the inner-product switch hold squared L2 distances
+    legacy_index = faiss.IndexFlatL2(search_service.embedding_dim)
+    legacy_index.add(normalized.astype('float32'))
+    search_service.index = legacy_index
+    
+    assert search_service.search(mock_embeddings[0], k=10, similarity_threshold=-1.0) == [
+        (product_id, pytest.approx(similarity, abs=1e-5)) for product_id, similarity in results
+    ]
+
+
+def test_search_batch(search_service, mock_embeddings):
+    """Test that batched queries match individual searches."""
+    product_ids = list(range(1, 11))
+    search_service.build_index(mock_embeddings, product_ids)
+    queries = mock_embeddings[:3]
+    
+    batch_results = search_service.search_batch(queries, k=4, similarity_threshold=-1.0)
+    
+    assert len(batch_results) == 3
+    for query, results in zip(queries, batch_results):
+        assert results == search_service.search(query, k=4, similarity_threshold=-1.0)
+    assert [results[0][0] for results in batch_results] == [1, 2, 3]
+
+
+def test_prenormalized_embeddings(search_service, mock_embeddings):
+    """Test that unit-norm embeddings skip re-normalization without changing results."""
+    product_ids = list(range(1, 11))
+    normalized = (mock_embeddings / np.linalg.norm(mock_embeddings, axis=1, keepdims=True)).astype(np.float32)
+    search_service.build_index(normalized, product_ids)
+    expected = search_service.search_batch(normalized[:3], k=5, similarity_threshold=-1.0)
+    
+    search_service.prenormalized = True
+    search_service.build_index(normalized, product_ids)
+    query = normalized[:3].copy()
+    query.setflags(write=False)
+    
+    results = search_service.search_batch(query, k=5, similarity_threshold=-1.0)
+    for row, expected_row in zip(results, expected):
+        assert [score for _, score in row] == pytest.approx([score for _, score in expected_row], abs=1e-5)
+    
+    # Raw vectors are still normalized (on a copy) at build time
+    raw = mock_embeddings.astype(np.float32)
+    search_service.build_index(raw, product_ids)
+    assert np.array_equal(raw, mock_embeddings.astype(np.float32))
+    assert search_service.search(normalized[0], k=1)[0][0] == 1
+
+
+def test_build_index_in_chunks(search_service, mock_embeddings):
+    """Test that adding in chunks builds the same index as one batch."""
+    product_ids = list(range(1, 11))
+    search_service.index_factory = 'Flat'
+    search_service.build_index(mock_embeddings, product_ids)
+    expected = search_service.search_batch(mock_embeddings[:3], k=5, similarity_threshold=-1.0)
+    expected_embeddings = np.array(search_service.embeddings)
+    
+    search_service.ADD_CHUNK_SIZE = 3
+    search_service.build_index(mock_embeddings, product_ids)
+    
+    assert search_service.index.ntotal == 10
+    assert np.array_equal(search_service.embeddings, expected_embeddings)
+    assert search_service.search_batch(mock_embeddings[:3], k=5, similarity_threshold=-1.0) == expected
@@ -0,0 +1,159 @@
+"""
+Tests for security middleware helpers.
+"""
+import io
+
+import pytest
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+
+from src.middleware.security import (
+    build_security_headers,
+    require_valid_request,
+    validate_file_upload,
+    validate_url_safety
+)
+
+
+def make_upload(data: bytes, filename: str = 'photo.jpg', content_type: str = 'image/jpeg') -> FileStorage:
+    """Build an in-memory upload as Flask would hand it to a route."""
+    return FileStorage(stream=io.BytesIO(data), filename=filename, content_type=content_type)
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1/image.jpg',
+    'http://[::1]/image.jpg',
+    'http://10.0.0.1/image.jpg',
+    'http://172.16.5.4/image.jpg',
+    'http://192.168.1.1/image.jpg',
+    'http://169.254.169.254/latest/meta-data/',
+    'http://[fe80::1]/image.jpg',
+    'http://100.64.1.1/image.jpg',
+    'http://[::ffff:10.0.0.1]/image.jpg',
+    'http://[fd00::1]/image.jpg',
+])
+def test_validate_url_safety_blocks_private_ips(url):
+    """Test that loopback, private, link-local and CGNAT addresses are rejected."""
+    is_valid, error = validate_url_safety(url, {})
+    assert is_valid is False
+    assert error == "Access to private IP addresses is not allowed"
+
+
+@pytest.mark.parametrize('url', [
+    'https://8.8.8.8/image.jpg',
+    'https://[2606:4700::1111]/image.jpg',
+    'https://example.com/image.jpg',
+])
+def test_validate_url_safety_allows_public_hosts(url):
+    """Test that public addresses and hostnames pass validation."""
+    assert validate_url_safety(url, {}) == (True, None)
+
+
+def test_validate_url_safety_blocks_localhost():
+    """Test that localhost hostnames are rejected."""
+    is_valid, error = validate_url_safety('http://localhost:5000/', {})
+    assert is_valid is False
+    assert error == "Access to localhost is not allowed"
+
+
+def test_validate_url_safety_rejects_scheme():
+    """Test that non-HTTP schemes are rejected."""
+    is_valid, _ = validate_url_safety('file:///etc/passwd', {})
+    assert is_valid is False
+
+
+@pytest.mark.parametrize('data', [
+    b'\xff\xd8\xff\xe0' + b'\x00' * 32,
+    b'\x89PNG\r\n\x1a\n' + b'\x00' * 32,
+    b'RIFF\x00\x00\x00\x00WEBPVP8 ' + b'\x00' * 32,
+])
+def test_validate_file_upload_accepts_images(data):
+    """Test that uploads with an image signature pass and stay rewound."""
+    upload = make_upload(data)
+    assert validate_file_upload(upload, {}) == (True, None)
+    assert upload.stream.tell() == 0
+
+
+def test_validate_file_upload_rejects_spoofed_content_type():
+    """Test that a declared image type must match the file's leading bytes."""
+    is_valid, error = validate_file_upload(make_upload(b'<?php echo 1; ?>'), {})
+    assert is_valid is False
+    assert error == "File content is not a supported image format"
+
+
+def test_validate_file_upload_rejects_oversized_file():
+    """Test the size limit when no Content-Length is available."""
+    config = {'security': {'upload_safety': {'max_file_size_mb': 1}}}
+    upload = make_upload(b'\xff\xd8\xff' + b'\x00' * (1024 * 1024))
+    is_valid, error = validate_file_upload(upload, config)
+    assert is_valid is False
+    assert error == "File size exceeds maximum of 1MB"
+
+
+@pytest.mark.parametrize('filename', ['shell.php', 'payload.JPG.exe', 'run.sh'])
+def test_validate_file_upload_rejects_executables(filename):
+    """Test that executable extensions are rejected regardless of case."""
+    upload = make_upload(b'\xff\xd8\xff' + b'\x00' * 32, filename=filename)
+    assert validate_file_upload(upload, {}) == (False, "Executable files are not allowed")
+
+
+def test_validate_url_safety_uses_configured_policy():
+    """Test that length and scheme limits come from the configuration."""
+    config = {'security': {'request_validation': {
+        'max_url_length': 30,
+        'allowed_url_schemes': ['https']
+    }}}
+    assert validate_url_safety('https://example.com/a.jpg', config) == (True, None)
+    assert validate_url_safety('http://example.com/a.jpg', config) == (
+        False, "URL scheme must be one of: https"
+    )
+    is_valid, error = validate_url_safety('https://example.com/' + 'a' * 20, config)
+    assert is_valid is False
+    assert 'maximum length of 30' in error
+
+
+def test_build_security_headers():
+    """Test that only configured headers are emitted, in a fixed order."""
+    config = {'security': {'headers': {
+        'x_content_type_options': 'nosniff',
+        'x_frame_options': 'DENY'
+    }}}
+    assert build_security_headers(config) == (
+        ('X-Frame-Options', 'DENY'),
+        ('X-Content-Type-Options', 'nosniff')
+    )
+    assert build_security_headers({}) == ()
+
+
+def test_require_valid_request_rejects_oversized_body():
+    """Test the Content-Length guard resolved from the configuration."""
+    app = Flask(__name__)
+    config = {'security': {'upload_safety': {'max_file_size_mb': 1}}}
+    
+    @app.route('/upload', methods=['POST'])
+    @require_valid_request(config)
+    def upload():
+        return 'ok'
+    
+    client = app.test_client()
+    assert client.post('/upload', data=b'x' * 1024).status_code == 200
+    
+    response = client.post('/upload', data=b'x' * (2 * 1024 * 1024 + 1))
+    assert response.status_code == 413
+    assert response.get_json()['message'] == 'Maximum request size is 1MB'
+
+
+@pytest.mark.parametrize('url', [
+    'http://metadata.google.internal/computeMetadata/v1/',
+    'http://db.corp.INTERNAL/image.jpg',
+    'http://169.254.169.254.nip.io/image.jpg',
+])
+def test_validate_url_safety_blocks_internal_hostnames(url):
+    """Test that metadata, link-local and internal domain names are rejected."""
+    assert validate_url_safety(url, {}) == (False, "Access to internal resources is not allowed")
+
+
+def test_validate_url_safety_allows_near_miss_hostname():
+    """Test that a long hostname that only resembles an internal domain passes."""
+    url = 'http://' + 'a.' * 1000 + 'internalx/'
+    assert validate_url_safety(url, {}) == (True, None)